@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+翻译流程吞吐基准（离线）
+
+启动 mock_server 模拟接口，对每个本地化文件运行 SilksongTranslator.translate_file，
+统计墙钟耗时、请求数、重试数与每秒条目数。不需要API密钥，也不消耗额度。
+
+用法: python benchmarks/bench_pipeline.py [--latency lognormal:0.8,0.4] [--rate-429 0.05] [--concurrency 4]
+      python benchmarks/bench_pipeline.py --files src/main/resources/localization/silksong/cards.json
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import asyncio
+import argparse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_server import add_mock_arguments, start_server, state_from_args  # noqa: E402
+from trans import SilksongTranslator  # noqa: E402
+
+DEFAULT_DIR = os.path.join(ROOT, 'src', 'main', 'resources', 'localization', 'silksong')
+
+
+def fetch_stats(base_url: str) -> dict:
+    with urllib.request.urlopen(base_url + '/stats') as response:
+        return json.loads(response.read())
+
+
+async def bench_file(path: str, base_url: str, args) -> dict:
+    """用全新的翻译器（无缓存、无去重历史）翻译一个文件并计时"""
+    translator = SilksongTranslator(api_key='mock', api_url=base_url,
+                                    concurrency=args.concurrency, max_concurrency=args.max_concurrency,
+                                    token_budget=args.token_budget, stream=args.stream,
+                                    hedge_percentile=args.hedge)
+    before = fetch_stats(base_url)
+    start = time.perf_counter()
+    await translator.translate_file(path, 'mock-model')
+    elapsed = time.perf_counter() - start
+    after = fetch_stats(base_url)
+
+    translated = after['entries'] - before['entries']
+    return {
+        'file': os.path.basename(path),
+        'seconds': elapsed,
+        'requests': after['requests'] - before['requests'],
+        'retries': translator.api_retries,
+        'rejected': (after['rejected_429'] - before['rejected_429']) + (after['rejected_502'] - before['rejected_502']),
+        'entries': translated,
+        'entries_per_sec': translated / elapsed if elapsed else 0.0,
+        'final_limit': int(translator.limiter.limit),
+        'hedges': translator.hedges,
+        'wasted_tokens': translator.hedge_wasted_tokens,
+    }
+
+
+def print_report(rows: list):
+    print(f"\n{'文件':<20}{'耗时(s)':>9}{'请求':>7}{'重试':>7}{'拒绝':>7}{'条目':>8}{'条目/秒':>10}{'末并发':>8}")
+    for row in rows:
+        print(f"{row['file']:<20}{row['seconds']:>9.2f}{row['requests']:>7}{row['retries']:>7}"
+              f"{row['rejected']:>7}{row['entries']:>8}{row['entries_per_sec']:>10.1f}{row['final_limit']:>8}")
+    total_seconds = sum(row['seconds'] for row in rows)
+    total_entries = sum(row['entries'] for row in rows)
+    print(f"{'合计':<20}{total_seconds:>9.2f}{sum(row['requests'] for row in rows):>7}"
+          f"{sum(row['retries'] for row in rows):>7}{sum(row['rejected'] for row in rows):>7}"
+          f"{total_entries:>8}{total_entries / total_seconds if total_seconds else 0:>10.1f}")
+
+
+async def run(args):
+    server, base_url = start_server(state_from_args(args))
+    files = args.files or sorted(glob.glob(os.path.join(DEFAULT_DIR, '*.json')), key=os.path.getsize, reverse=True)
+    print(f"模拟接口: {base_url}，延迟分布 {args.latency}，429概率 {args.rate_429}，502概率 {args.rate_502}")
+
+    rows = []
+    try:
+        for path in files:
+            rows.append(await bench_file(path, base_url, args))
+    finally:
+        server.shutdown()
+    print_report(rows)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存: {args.json}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="翻译流程离线吞吐基准")
+    parser.add_argument('--files', nargs='*', help="要测试的JSON文件（默认为silksong目录下全部文件）")
+    parser.add_argument('--concurrency', type=int, default=4, help="初始并发批次数")
+    parser.add_argument('--max-concurrency', type=int, default=32, help="并发批次数上限")
+    parser.add_argument('--token-budget', type=int, default=4000, help="每批输入token预算")
+    parser.add_argument('--stream', action='store_true', help="使用流式输出")
+    parser.add_argument('--hedge', type=float, default=0, help="对冲请求的延迟分位数（0为关闭）")
+    parser.add_argument('--json', help="把结果另存为JSON，便于对比不同改动")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
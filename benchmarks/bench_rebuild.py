@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+rebuild_json_structure 微基准
+
+对比旧实现（按下划线拆分key、每条译文从根重新查找、json往返深拷贝）
+与按提取位置直接写回的新实现。
+
+用法: python benchmarks/bench_rebuild.py [JSON文件 ...]
+默认使用 src/main/resources/localization/silksong/ 下的 cards.json 与 events.json
+"""
+
+import os
+import sys
+import json
+import logging
+import timeit
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# 只用到提取与重建，不会发起请求
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+
+from trans import SilksongTranslator  # noqa: E402
+
+DEFAULT_FILES = [
+    os.path.join(ROOT, 'src', 'main', 'resources', 'localization', 'silksong', 'cards.json'),
+    os.path.join(ROOT, 'src', 'main', 'resources', 'localization', 'silksong', 'events.json'),
+]
+
+
+class LegacyRebuilder:
+    """旧版提取与重建逻辑（原样保留，仅供对比）"""
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def _extract_translation_items(self, data, translation_items, prefix=""):
+        """递归提取待翻译文本"""
+        if isinstance(data, dict):
+            for key, item_data in data.items():
+                current_prefix = f"{prefix}_{key}" if prefix else key
+                
+                if isinstance(item_data, dict):
+                    # 处理NAME字段
+                    if 'NAME' in item_data:
+                        translation_items.append((f"{current_prefix}_NAME", item_data['NAME']))
+                    elif 'NAMES' in item_data and item_data['NAMES']:
+                        # 如果NAMES是列表，把列表里的每一项都提取
+                        for idx, name in enumerate(item_data['NAMES']):
+                            if isinstance(name, str):
+                                translation_items.append((f"{current_prefix}_NAME_{idx}", name))
+                    
+                    # 处理DESCRIPTION字段
+                    if 'DESCRIPTION' in item_data:
+                        translation_items.append((f"{current_prefix}_DESC", item_data['DESCRIPTION']))
+                    elif 'UPGRADE_DESCRIPTION' in item_data:
+                        translation_items.append((f"{current_prefix}_UPGRADE_DESC", item_data['UPGRADE_DESCRIPTION']))
+                        
+                    # 处理TEXT字段（UI文本）
+                    if 'TEXT' in item_data:
+                        if isinstance(item_data['TEXT'], list):
+                            for i, text in enumerate(item_data['TEXT']):
+                                translation_items.append((f"{current_prefix}_TEXT_{i}", text))
+                        elif isinstance(item_data['TEXT'], str):
+                            translation_items.append((f"{current_prefix}_TEXT", item_data['TEXT']))
+                    
+                    # 处理其他可能包含文本的字段（如UNIQUE_REWARDS, OPTIONS等）
+                    for field_name, field_value in item_data.items():
+                        if field_name not in ['NAME', 'NAMES', 'DESCRIPTION', 'UPGRADE_DESCRIPTION', 'TEXT']:
+                            if isinstance(field_value, list):
+                                for i, text in enumerate(field_value):
+                                    if isinstance(text, str):
+                                        translation_items.append((f"{current_prefix}_{field_name}_{i}", text))
+                            elif isinstance(field_value, str):
+                                translation_items.append((f"{current_prefix}_{field_name}", field_value))
+                            elif isinstance(field_value, dict):
+                                # 递归处理嵌套字典
+                                self._extract_translation_items(field_value, translation_items, f"{current_prefix}_{field_name}")
+                elif isinstance(item_data, list):
+                    # 处理直接的列表字段（如keywords.json中的TEXT字段）
+                    for i, text in enumerate(item_data):
+                        if isinstance(text, str):
+                            translation_items.append((f"{current_prefix}_{i}", text))
+                        elif isinstance(text, dict):
+                            # 如果列表中包含字典，递归处理
+                            self._extract_translation_items(text, translation_items, f"{current_prefix}_{i}")
+                elif isinstance(item_data, str):
+                    # 处理直接的字符串字段
+                    translation_items.append((current_prefix, item_data))
+                else:
+                    # 如果item_data本身不包含翻译字段，但是一个字典容器，继续递归
+                    if isinstance(item_data, dict):
+                        self._extract_translation_items(item_data, translation_items, current_prefix)
+    
+    def rebuild_json_structure(self, original_data: Dict, translations: Dict[str, str]) -> Dict:
+        """重建JSON结构，将翻译结果合并回原始格式
+        - 支持多层嵌套（prefix用下划线连接）
+        - 正确处理以下键格式：
+          * <path>_NAME
+          * <path>_DESC
+          * <path>_UPGRADE_DESC
+          * <path>_TEXT           (TEXT为字符串)
+          * <path>_TEXT_<idx>     (TEXT为列表)
+          * <path>_<FIELD>        (任意单字段字符串)
+          * <path>_<FIELD>_<idx>  (任意列表字段)
+        - 如果字段本身是列表，则把列表里的每一项都翻译
+        """
+        result_data = json.loads(json.dumps(original_data))  # 深拷贝
+
+        def get_nested_container(root: Dict, path_parts: List[str]):
+            """根据路径片段进入嵌套字典，返回目标容器(dict)。若路径不存在则返回None"""
+            node = root
+            for part in path_parts:
+                if isinstance(node, dict) and part in node:
+                    node = node[part]
+                else:
+                    return None
+            return node
+
+        for key, translation in translations.items():
+            parts = key.split('_')
+            if len(parts) < 2:
+                continue
+
+            original_text = None
+
+            # 情况一：末尾是固定字段名（无索引）
+            if parts[-1] in ("NAME", "DESC", "UPGRADE_DESC", "TEXT"):
+                field_tag = parts[-1]
+                container_path = parts[:-1]
+                container = get_nested_container(result_data, container_path)
+                if not isinstance(container, dict):
+                    continue
+
+                if field_tag == 'NAME':
+                    if 'NAME' in container and isinstance(container['NAME'], str):
+                        original_text = container['NAME']
+                        container['NAME'] = translation
+                    elif 'NAMES' in container and isinstance(container['NAMES'], list):
+                        # 如果NAMES是列表，把列表里的每一项都翻译
+                        for idx, item in enumerate(container['NAMES']):
+                            if isinstance(item, str):
+                                original_text = item
+                                container['NAMES'][idx] = translation
+                                self.logger.info(f"翻译: [{key}_{idx}] {original_text} -> {translation}")
+                        continue  # 已经记录日志，跳过下面的统一记录
+                elif field_tag == 'DESC':
+                    if 'DESCRIPTION' in container and isinstance(container['DESCRIPTION'], str):
+                        original_text = container['DESCRIPTION']
+                        container['DESCRIPTION'] = translation
+                elif field_tag == 'UPGRADE_DESC':
+                    if 'UPGRADE_DESCRIPTION' in container and isinstance(container['UPGRADE_DESCRIPTION'], str):
+                        original_text = container['UPGRADE_DESCRIPTION']
+                        container['UPGRADE_DESCRIPTION'] = translation
+                elif field_tag == 'TEXT':
+                    if 'TEXT' in container and isinstance(container['TEXT'], str):
+                        original_text = container['TEXT']
+                        container['TEXT'] = translation
+                    elif 'TEXT' in container and isinstance(container['TEXT'], list):
+                        # 如果TEXT是列表，把列表里的每一项都翻译
+                        for idx, item in enumerate(container['TEXT']):
+                            if isinstance(item, str):
+                                original_text = item
+                                container['TEXT'][idx] = translation
+                                self.logger.info(f"翻译: [{key}_{idx}] {original_text} -> {translation}")
+                        continue  # 已经记录日志，跳过下面的统一记录
+
+            # 情况二：末尾是索引（列表项），如 _TEXT_3 或 _OPTIONS_1
+            elif parts[-1].isdigit():
+                idx = int(parts[-1])
+                
+                if len(parts) >= 3:
+                    # 标准情况：container_field_idx
+                    field_name = parts[-2]
+                    container_path = parts[:-2]
+                    container = get_nested_container(result_data, container_path)
+                    if not isinstance(container, dict):
+                        continue
+
+                    # NAME列表（NAMES字段）
+                    if field_name == 'NAME':
+                        if 'NAMES' in container and isinstance(container['NAMES'], list) and 0 <= idx < len(container['NAMES']):
+                            if isinstance(container['NAMES'][idx], str):
+                                original_text = container['NAMES'][idx]
+                                container['NAMES'][idx] = translation
+                    # TEXT列表
+                    elif field_name == 'TEXT':
+                        if 'TEXT' in container and isinstance(container['TEXT'], list) and 0 <= idx < len(container['TEXT']):
+                            original_text = container['TEXT'][idx]
+                            container['TEXT'][idx] = translation
+                    else:
+                        # 其他列表字段（如 OPTIONS、UNIQUE_REWARDS 等）
+                        if field_name in container and isinstance(container[field_name], list) and 0 <= idx < len(container[field_name]):
+                            if isinstance(container[field_name][idx], str):
+                                original_text = container[field_name][idx]
+                                container[field_name][idx] = translation
+                elif len(parts) == 2:
+                    # 直接列表字段情况：field_idx（如 TEXT_0）
+                    field_name = parts[0]
+                    container = result_data
+                    if field_name in container and isinstance(container[field_name], list) and 0 <= idx < len(container[field_name]):
+                        if isinstance(container[field_name][idx], str):
+                            original_text = container[field_name][idx]
+                            container[field_name][idx] = translation
+
+            # 情况三：任意单字段字符串，如 _FOOTER 之类
+            else:
+                if len(parts) == 1:
+                    # 直接字符串字段情况（如单独的字符串字段）
+                    field_name = parts[0]
+                    container = result_data
+                    if field_name in container and isinstance(container[field_name], str):
+                        original_text = container[field_name]
+                        container[field_name] = translation
+                else:
+                    # 嵌套字段情况
+                    field_name = parts[-1]
+                    container_path = parts[:-1]
+                    container = get_nested_container(result_data, container_path)
+                    if not isinstance(container, dict):
+                        continue
+                    if field_name in container and isinstance(container[field_name], str):
+                        original_text = container[field_name]
+                        container[field_name] = translation
+
+            # 记录日志（列表翻译已在循环内记录，这里只记录单个字符串的翻译）
+            if original_text is not None:
+                self.logger.info(f"翻译: [{key}] {original_text} -> {translation}")
+
+        return result_data
+
+
+def bench_file(path: str, translator: SilksongTranslator, legacy: LegacyRebuilder, repeat: int, number: int):
+    """对单个文件分别计时旧/新实现的重建阶段（提取在translate_file中本就要做，不计入）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    
+    items = []
+    refs = {}
+    translator._extract_translation_items(data, items, refs=refs)
+    translations = {key: f"译{text}" for key, text in items}
+    
+    def run_legacy():
+        return legacy.rebuild_json_structure(data, translations)
+    
+    def run_new():
+        return translator.rebuild_json_structure(data, translations, refs)
+    
+    legacy_time = min(timeit.repeat(run_legacy, repeat=repeat, number=number)) / number
+    new_time = min(timeit.repeat(run_new, repeat=repeat, number=number)) / number
+    
+    # 统计实际写回的译文条数，顺带检查新实现是否覆盖全部条目
+    legacy_written = count_translated(data, run_legacy())
+    new_written = count_translated(data, run_new())
+    
+    name = os.path.basename(path)
+    print(f"{name:<16} 条目 {len(items):>5}  "
+          f"旧 {legacy_time * 1000:8.2f} ms（写回 {legacy_written:>5}）  "
+          f"新 {new_time * 1000:8.2f} ms（写回 {new_written:>5}）  "
+          f"加速 {legacy_time / new_time:5.1f}x")
+
+
+def count_translated(original, rebuilt) -> int:
+    """统计与原文不同的字符串数"""
+    if isinstance(original, dict):
+        return sum(count_translated(value, rebuilt[key]) for key, value in original.items())
+    if isinstance(original, list):
+        return sum(count_translated(value, new) for value, new in zip(original, rebuilt))
+    return int(original != rebuilt)
+
+
+def main(argv: List[str] = None):
+    files = (argv if argv is not None else sys.argv[1:]) or DEFAULT_FILES
+    
+    translator = SilksongTranslator()
+    # 基准只衡量重建本身，不写逐条日志
+    quiet = logging.getLogger('SilksongTranslator.bench')
+    quiet.addHandler(logging.NullHandler())
+    quiet.propagate = False
+    translator.logger = quiet
+    legacy = LegacyRebuilder(quiet)
+    
+    for path in files:
+        bench_file(path, translator, legacy, repeat=5, number=20)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+解析器等价性检查（离线）
+
+几个手写解析器的行为很微妙，这里用随机输入把它们与参照实现逐一对比，
+改动相关代码后运行一遍，任何不一致都会打印出最小的复现输入并以非零状态退出。
+
+- TranslationStreamParser：任意切分的流式文本，解析出的条目与json.loads完全一致，且对象一闭合就产出
+- fix_keywords_in_text：单遍扫描实现与原先逐条正则替换的实现结果一致（随机文本与全部本地化文件）
+- iter_json_object / JsonObjectWriter：任意读取块大小下逐项读出的结果与json.load一致，
+  逐项写出的文件与save_json逐字节相同（随机文档与全部本地化文件）
+
+用法: python benchmarks/check_parsers.py [--cases 20000] [--seed 0]
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import random
+import tempfile
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fix_keywords import fix_keywords_in_text  # noqa: E402
+from trans import JsonObjectWriter, TranslationStreamParser, iter_json_object, save_json  # noqa: E402
+
+LOCALIZATION_DIR = os.path.join(ROOT, 'src', 'main', 'resources', 'localization', 'silksong')
+
+# 容易让手写解析器出错的字符：引号、转义、括号、关键词与中文
+TRICKY = ['"', '\\', '{', '}', '[', ']', ',', ':', ' ', '\n', 'NL', '[E]', '[G]', 'a', '1', '.', 'e', '-', '译', '。']
+
+
+def random_text(rng: random.Random, max_parts: int = 8) -> str:
+    return ''.join(rng.choice(TRICKY) for _ in range(rng.randint(0, max_parts)))
+
+
+def random_chunks(rng: random.Random, text: str) -> list:
+    """把文本切成随机长度的片段（含长度为1的极端情况）"""
+    chunks, i = [], 0
+    while i < len(text):
+        size = 1 if rng.random() < 0.3 else rng.randint(1, 16)
+        chunks.append(text[i:i + size])
+        i += size
+    return chunks
+
+
+def check_stream_parser(rng: random.Random, cases: int) -> int:
+    """随机条目序列化后任意切分喂入，结果须与原条目一致；逐字符喂入时每个对象闭合即产出"""
+    failures = 0
+    for _ in range(cases):
+        entries = [{'key': random_text(rng, 4), 'translation': random_text(rng)}
+                   for _ in range(rng.randint(0, 5))]
+        if entries and rng.random() < 0.2:
+            entries[0]['extra'] = {'nested': [random_text(rng, 3)]}
+        body = json.dumps({'translations': entries}, ensure_ascii=rng.random() < 0.5,
+                          indent=rng.choice([None, 2]))
+        # 模型偶尔会在JSON前后加代码块标记
+        text = rng.choice(['', '```json\n']) + body + rng.choice(['', '\n```'])
+
+        parser = TranslationStreamParser()
+        parsed = []
+        for chunk in random_chunks(rng, text):
+            parsed.extend(parser.feed(chunk))
+
+        # 逐字符喂入：第k个对象的右花括号到达时，正好已产出k个对象
+        eager = TranslationStreamParser()
+        produced, ends = 0, []
+        for i, ch in enumerate(text):
+            new = eager.feed(ch)
+            produced += len(new)
+            if new:
+                ends.append((i, produced))
+
+        if parsed != entries or produced != len(entries) or any(text[i] != '}' for i, _ in ends):
+            failures += 1
+            if failures <= 3:
+                print(f"TranslationStreamParser 不一致: {text!r}\n  期望 {entries!r}\n  实际 {parsed!r}")
+    return failures
+
+
+# 旧版fix_keywords的逐条正则替换（原样保留，仅供对比）
+LEGACY_KEYWORD_PATTERNS = [
+    (r'([^\s])\[([GEBRW])\]([^\s。，！？])', r'\1 [\2] \3'),
+    (r'([^\s])\[([GEBRW])\]', r'\1 [\2]'),
+    (r'\[([GEBRW])\]([^\s。，！？])', r'[\1] \2'),
+    (r'([^\s])NL([^\s])', r'\1 NL \2'),
+    (r'([^\s])NL', r'\1 NL'),
+    (r'NL([^\s])', r'NL \1'),
+    (r'^NL([^\s])', r'NL \1'),
+]
+
+
+def legacy_fix_keywords(text: str) -> str:
+    for pattern, replacement in LEGACY_KEYWORD_PATTERNS:
+        text = re.sub(pattern, replacement, text)
+    return text
+
+
+def iter_strings(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from iter_strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from iter_strings(item)
+
+
+def check_fix_keywords(rng: random.Random, cases: int) -> int:
+    """随机拼接关键词、标点与空白，以及全部本地化文件中的字符串，新旧实现须逐字相同"""
+    parts = ['NL', 'N', 'L', '[E]', '[G]', '[B]', '[R]', '[W]', '[X]', '[', ']', ' ', '\n', '\t',
+             '。', '，', '！', '？', 'a', '译', '#y', '!D!']
+    texts = [''.join(rng.choice(parts) for _ in range(rng.randint(0, 10))) for _ in range(cases)]
+    for path in sorted(glob.glob(os.path.join(LOCALIZATION_DIR, '*.json'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            texts.extend(iter_strings(json.load(f)))
+
+    failures = 0
+    for text in texts:
+        expected, actual = legacy_fix_keywords(text), fix_keywords_in_text(text)
+        if expected != actual:
+            failures += 1
+            if failures <= 3:
+                print(f"fix_keywords_in_text 不一致: {text!r}\n  旧 {expected!r}\n  新 {actual!r}")
+    return failures
+
+
+def random_value(rng: random.Random, depth: int = 0):
+    """随机JSON值：重点覆盖各种写法的数字（读取块边界可能把它们截断）"""
+    kind = rng.randint(0, 7 if depth < 3 else 4)
+    if kind == 0:
+        return rng.randint(-10 ** rng.randint(0, 12), 10 ** rng.randint(0, 12))
+    if kind == 1:
+        return rng.choice([1.5, -0.25, 1e5, 2.5e-7, 123456.789, 0.0, -1e-300])
+    if kind == 2:
+        return rng.choice([True, False, None])
+    if kind in (3, 4):
+        return random_text(rng)
+    if kind == 5:
+        return [random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return {random_text(rng, 3): random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))}
+
+
+def check_json_stream(rng: random.Random, cases: int) -> int:
+    """随机文档（不同缩进、BOM）在1~64及默认读取块大小下逐项读取；逐项写出须与save_json相同"""
+    documents = []
+    for _ in range(max(1, cases // 20)):
+        data = {random_text(rng, 4): random_value(rng) for _ in range(rng.randint(0, 6))}
+        text = json.dumps(data, ensure_ascii=rng.random() < 0.5, indent=rng.choice([None, 2, '\t']),
+                          separators=rng.choice([None, (',', ':')]))
+        documents.append((data, rng.choice(['', '\ufeff']) + rng.choice(['', ' \n']) + text))
+    # 数字恰好在读取块边界处被截断（如1.5只读到"1."）
+    pad = 'x' * (65536 - len('{"p":"","v":1.'))
+    documents.append(({'p': pad, 'v': 1.5}, '{"p":"%s","v":1.5}' % pad))
+    for path in sorted(glob.glob(os.path.join(LOCALIZATION_DIR, '*.json'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        documents.append((json.loads(text), text))
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        source, written, expected = (os.path.join(tmp, name) for name in ('in.json', 'out.json', 'ref.json'))
+        for data, text in documents:
+            with open(source, 'w', encoding='utf-8') as f:
+                f.write(text)
+            sizes = [rng.randint(1, 64), 1 << 16] if len(text) > 4096 else list(range(1, 65)) + [1 << 16]
+            for size in sizes:
+                try:
+                    actual = dict(iter_json_object(source, size))
+                except ValueError as e:
+                    actual = e
+                if actual != data:
+                    failures += 1
+                    if failures <= 3:
+                        print(f"iter_json_object 不一致（读取块 {size}）: {text[:200]!r}\n  实际 {actual!r}"[:600])
+                    break
+
+            writer = JsonObjectWriter(written)
+            for key, value in data.items():
+                writer.write(key, value)
+            writer.close()
+            save_json(data, expected)
+            with open(written, 'rb') as a, open(expected, 'rb') as b:
+                if a.read() != b.read():
+                    failures += 1
+                    if failures <= 3:
+                        print(f"JsonObjectWriter 与save_json不一致: {data!r}"[:600])
+    return failures
+
+
+CHECKS = [
+    ('TranslationStreamParser', check_stream_parser),
+    ('fix_keywords_in_text', check_fix_keywords),
+    ('iter_json_object', check_json_stream),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="解析器等价性检查")
+    parser.add_argument('--cases', type=int, default=20000, help="每项检查的随机用例数（默认20000）")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+
+    total = 0
+    for name, check in CHECKS:
+        failures = check(random.Random(args.seed), args.cases)
+        print(f"{name:<28}{'通过' if not failures else f'失败 {failures} 例'}")
+        total += failures
+    sys.exit(1 if total else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,39 +3,80 @@
 """
 修复杀戮尖塔JSON文件中预留关键词的空格问题
 确保关键词如 NL, [G], [E], [B], [R], [W] 等前后至少有一个英文空格
+
+- 单遍扫描：一个正则切分出所有关键词，按前后字符一次性补空格
+- 多进程并行处理目录下的文件
+- 记录上次处理后的文件哈希，未变化的文件直接跳过；结果与原内容相同则不写回
+- 写回采用临时文件+替换，中途失败不会留下半截文件
+
+用法: python fix_keywords.py [目录] [--jobs N] [--manifest 路径] [--force]
 """
 
+import argparse
+import hashlib
 import json
 import os
 import re
-from typing import Dict, Any
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Tuple
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'src', 'main', 'resources', 'localization', 'silksong')
+DEFAULT_MANIFEST = os.path.join('silksong_test', 'fix_keywords_hashes.json')
+
+# 能量符号 [G], [E], [B], [R], [W] 与 NL 换行符
+KEYWORD_PATTERN = re.compile(r'(\[[GEBRW]\]|NL)')
+# 能量符号后紧跟这些标点时不补空格
+ENERGY_TRAILING_PUNCT = '。，！？'
+
 
 def fix_keywords_in_text(text: str) -> str:
     """
     修复文本中的关键词空格问题
+
+    与逐条正则替换的旧实现结果一致：关键词前若紧挨非空白字符则补一个空格；
+    NL后若紧挨非空白字符则补一个空格；能量符号后若紧挨非空白且非中文句读则补一个空格。
     """
     if not isinstance(text, str):
         return text
-    
-    # 定义需要处理的关键词模式
-    patterns = [
-        # 能量符号 [G], [E], [B], [R], [W] - 处理各种边界情况
-        (r'([^\s])\[([GEBRW])\]([^\s。，！？])', r'\1 [\2] \3'),  # 前后都没空格
-        (r'([^\s])\[([GEBRW])\]', r'\1 [\2]'),  # 前面没空格
-        (r'\[([GEBRW])\]([^\s。，！？])', r'[\1] \2'),  # 后面没空格（排除标点）
-        
-        # NL 换行符 - 处理各种边界情况
-        (r'([^\s])NL([^\s])', r'\1 NL \2'),  # 前后都没空格
-        (r'([^\s])NL', r'\1 NL'),  # 前面没空格
-        (r'NL([^\s])', r'NL \1'),  # 后面没空格
-        (r'^NL([^\s])', r'NL \1'),  # 行首后面没空格
-    ]
-    
-    result = text
-    for pattern, replacement in patterns:
-        result = re.sub(pattern, replacement, result)
-    
-    return result
+    if 'NL' not in text and '[' not in text:
+        return text
+
+    parts = KEYWORD_PATTERN.split(text)
+    if len(parts) == 1:
+        return text
+
+    out = []
+    last_char = ''
+    for i, part in enumerate(parts):
+        if i % 2 == 0:
+            # 普通文本片段
+            if part:
+                out.append(part)
+                last_char = part[-1]
+            continue
+
+        # 关键词：前面紧挨非空白则补空格
+        if last_char and not last_char.isspace():
+            out.append(' ')
+        out.append(part)
+        last_char = part[-1]
+
+        # 后面紧挨的字符：下一个文本片段的首字符，若为空则是下一个关键词的首字符
+        if parts[i + 1]:
+            next_char = parts[i + 1][0]
+        elif i + 2 < len(parts):
+            next_char = parts[i + 2][0]
+        else:
+            next_char = ''
+
+        if next_char and not next_char.isspace():
+            if part == 'NL' or next_char not in ENERGY_TRAILING_PUNCT:
+                out.append(' ')
+                last_char = ' '
+
+    return ''.join(out)
 
 def process_json_value(value: Any) -> Any:
     """
@@ -50,56 +91,149 @@ def process_json_value(value: Any) -> Any:
     else:
         return value
 
-def fix_json_file(file_path: str) -> bool:
+def file_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+def file_mode(file_path: str) -> int:
+    """已有文件沿用其权限；新文件按umask取普通文件的默认权限"""
+    try:
+        return os.stat(file_path).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+class AtomicFile:
+    """写入同目录下的临时文件，commit时再替换目标文件，中途失败调用discard不会留下半截文件
+
+    mkstemp创建的临时文件权限为0600，替换前改成原文件（或新文件默认）的权限。
+    也可用作上下文管理器：正常退出时commit，出现异常时discard。
+    """
+
+    def __init__(self, file_path: str, mode: str = 'wb', encoding: str = None):
+        self.file_path = file_path
+        directory = os.path.dirname(os.path.abspath(file_path))
+        fd, self.tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_path), suffix='.tmp')
+        self.file = os.fdopen(fd, mode, encoding=encoding)
+
+    def commit(self):
+        try:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            os.chmod(self.tmp_path, file_mode(self.file_path))
+            os.replace(self.tmp_path, self.file_path)
+        except BaseException:
+            self.discard()
+            raise
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self.file
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+def atomic_write(file_path: str, content: bytes):
+    """先写同目录下的临时文件再替换，避免中途失败留下半截文件"""
+    with AtomicFile(file_path) as f:
+        f.write(content)
+
+def fix_json_file(file_path: str, known_hash: str = None) -> Tuple[str, str, str]:
     """
     修复单个JSON文件
+
+    返回 (状态, 处理后内容的哈希, 错误信息)；状态为 skipped / unchanged / fixed / failed
     """
     try:
         # 读取原文件
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
+        with open(file_path, 'rb') as f:
+            original = f.read()
+        original_hash = file_hash(original)
+        if known_hash == original_hash:
+            return 'skipped', original_hash, ''
+
         # 处理数据
-        fixed_data = process_json_value(data)
-        
+        fixed_data = process_json_value(json.loads(original.decode('utf-8')))
+        fixed = json.dumps(fixed_data, ensure_ascii=False, indent=2).encode('utf-8')
+        if fixed == original:
+            return 'unchanged', original_hash, ''
+
         # 写回文件
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(fixed_data, f, ensure_ascii=False, indent=2)
-        
-        print(f"✓ 已处理: {os.path.basename(file_path)}")
-        return True
-        
+        atomic_write(file_path, fixed)
+        return 'fixed', file_hash(fixed), ''
+
     except Exception as e:
-        print(f"✗ 处理失败 {os.path.basename(file_path)}: {e}")
-        return False
+        return 'failed', '', str(e)
+
+def load_manifest(path: str) -> Dict[str, str]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_manifest(path: str, manifest: Dict[str, str]):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    atomic_write(path, json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode('utf-8'))
 
 def main():
     """
     主函数
     """
-    silksong_dir = "d:\\sts-mod-silksong-language\\src\\main\\resources\\localization\\silksong"
-    
+    parser = argparse.ArgumentParser(description="修复本地化JSON中NL与能量符号前后的空格")
+    parser.add_argument('directory', nargs='?', default=DEFAULT_DIR, help="JSON文件所在目录（默认为mod的silksong目录）")
+    parser.add_argument('--jobs', type=int, default=None, help="并行进程数（默认为CPU核数）")
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST, help="记录已处理文件哈希的清单路径")
+    parser.add_argument('--force', action='store_true', help="忽略哈希清单，重新检查所有文件")
+    args = parser.parse_args()
+
+    silksong_dir = args.directory
     if not os.path.exists(silksong_dir):
         print(f"错误: 目录不存在 {silksong_dir}")
         return
-    
+
     # 获取所有JSON文件
     json_files = [f for f in os.listdir(silksong_dir) if f.endswith('.json')]
-    
+
     if not json_files:
         print("未找到JSON文件")
         return
-    
+
     print(f"找到 {len(json_files)} 个JSON文件")
     print("开始处理...\n")
-    
-    success_count = 0
-    for json_file in sorted(json_files):
-        file_path = os.path.join(silksong_dir, json_file)
-        if fix_json_file(file_path):
-            success_count += 1
-    
-    print(f"\n处理完成: {success_count}/{len(json_files)} 个文件成功")
+
+    manifest = {} if args.force else load_manifest(args.manifest)
+    paths = [os.path.abspath(os.path.join(silksong_dir, f)) for f in sorted(json_files)]
+    known = [manifest.get(path) for path in paths]
+
+    counts = {'skipped': 0, 'unchanged': 0, 'fixed': 0, 'failed': 0}
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for path, (status, digest, error) in zip(paths, pool.map(fix_json_file, paths, known)):
+            counts[status] += 1
+            name = os.path.basename(path)
+            if status == 'failed':
+                print(f"✗ 处理失败 {name}: {error}")
+                manifest.pop(path, None)
+                continue
+            manifest[path] = digest
+            if status == 'fixed':
+                print(f"✓ 已修复: {name}")
+
+    save_manifest(args.manifest, manifest)
+
+    success_count = len(json_files) - counts['failed']
+    print(f"\n处理完成: {success_count}/{len(json_files)} 个文件成功"
+          f"（修复 {counts['fixed']}，无需改动 {counts['unchanged']}，未变化跳过 {counts['skipped']}）")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多进程/多机器共享的翻译任务队列（SQLite）
+
+- 协调者（queue命令）把每个文件的待翻译条目按token预算切成批次任务写入队列
+- 任意数量的worker（worker命令）认领任务、翻译、原子提交结果；可在多台机器上运行，只要共享队列文件与输入输出目录
+- 认领即获得租约，翻译期间定期续租；worker崩溃后租约过期，任务自动回到可认领状态
+- 某文件的全部任务完成后，由提交最后一个任务的worker重建并写出输出文件
+
+用法: python trans.py queue zhs/ silksong/ deepseek-chat [--queue silksong_test/queue.sqlite]
+      python trans.py worker [--queue silksong_test/queue.sqlite] [--lease 120]   （可同时启动多个）
+"""
+
+import os
+import json
+import time
+import shutil
+import socket
+import sqlite3
+import asyncio
+import argparse
+from typing import Dict, List, Optional
+
+from trans import (SilksongTranslator, OUTPUT_BUDGET, add_translator_arguments, close_translator,
+                   create_translator, extract_items, file_pairs, pack_batches, save_json, snapshot_path)
+
+DEFAULT_QUEUE = os.path.join('silksong_test', 'queue.sqlite')
+
+
+class JobQueue:
+    """基于SQLite的批次任务队列
+
+    jobs表每行一个批次：pending（待认领）→ leased（已认领，lease_until前有效）→ done / failed；
+    有条目没译成的任务交还为pending重试。
+    所有状态变更都在单条UPDATE或BEGIN IMMEDIATE事务内完成，多进程并发认领不会重复。
+    """
+
+    def __init__(self, path: str = DEFAULT_QUEUE, max_attempts: int = 3):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                output_path TEXT PRIMARY KEY,
+                input_path TEXT NOT NULL,
+                model TEXT NOT NULL,
+                jobs INTEGER NOT NULL,
+                assembled INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                output_path TEXT NOT NULL,
+                batch INTEGER NOT NULL,
+                items TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                owner TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, lease_until);
+            CREATE INDEX IF NOT EXISTS jobs_file ON jobs(output_path);
+        ''')
+
+    def add_file(self, input_path: str, output_path: str, model: str, batches: List[List[tuple]]):
+        """登记一个文件及其批次任务；同一输出文件已有任务时整体替换"""
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.execute('DELETE FROM jobs WHERE output_path = ?', (output_path,))
+            self.conn.execute('INSERT OR REPLACE INTO files (output_path, input_path, model, jobs) VALUES (?, ?, ?, ?)',
+                              (output_path, input_path, model, len(batches)))
+            self.conn.executemany('INSERT INTO jobs (output_path, batch, items) VALUES (?, ?, ?)',
+                                  [(output_path, batch_no, json.dumps(batch, ensure_ascii=False))
+                                   for batch_no, batch in enumerate(batches, 1)])
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def claim(self, owner: str, lease: float) -> Optional[Dict]:
+        """认领一个待处理或租约已过期的任务；超过max_attempts次仍未完成的任务标记为failed"""
+        while True:
+            now = time.time()
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute(
+                    '''SELECT j.id, j.output_path, j.batch, j.items, j.attempts, f.input_path, f.model
+                       FROM jobs j JOIN files f ON f.output_path = j.output_path
+                       WHERE j.status = 'pending' OR (j.status = 'leased' AND j.lease_until < ?)
+                       ORDER BY j.id LIMIT 1''', (now,)
+                ).fetchone()
+                if row is None:
+                    self.conn.execute('COMMIT')
+                    return None
+                job_id, output_path, batch_no, items, attempts, input_path, model = row
+                if attempts >= self.max_attempts:
+                    self.conn.execute("UPDATE jobs SET status = 'failed', owner = NULL WHERE id = ?", (job_id,))
+                    self.conn.execute('COMMIT')
+                    print(f"任务 {os.path.basename(output_path)}#{batch_no} 已尝试 {attempts} 次，标记为失败")
+                    continue
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                    (owner, now + lease, job_id)
+                )
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            return {'id': job_id, 'output_path': output_path, 'input_path': input_path, 'model': model,
+                    'batch': batch_no, 'items': [tuple(item) for item in json.loads(items)]}
+
+    def renew(self, job_id: int, owner: str, lease: float) -> bool:
+        """续租；租约已被他人接手时返回False"""
+        cursor = self.conn.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+            (time.time() + lease, job_id, owner)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: int, owner: str, translations: Dict[str, str]) -> bool:
+        """提交结果；只有仍持有该任务的worker能提交，过期后被他人接手的结果直接丢弃"""
+        cursor = self.conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, lease_until = NULL WHERE id = ? AND owner = ? AND status = 'leased'",
+            (json.dumps(translations, ensure_ascii=False), job_id, owner)
+        )
+        return cursor.rowcount == 1
+
+    def release(self, job_id: int, owner: str) -> Optional[str]:
+        """交还未能完成的任务：回到pending等待重试，已尝试max_attempts次则标记为failed
+
+        返回任务的新状态；租约已被他人接手时返回None。
+        """
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.conn.execute("SELECT attempts FROM jobs WHERE id = ? AND owner = ? AND status = 'leased'",
+                                    (job_id, owner)).fetchone()
+            status = None
+            if row is not None:
+                status = 'failed' if row[0] >= self.max_attempts else 'pending'
+                self.conn.execute('UPDATE jobs SET status = ?, owner = NULL, lease_until = NULL WHERE id = ?',
+                                  (status, job_id))
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return status
+
+    def file_ready(self, output_path: str) -> bool:
+        """文件的全部任务都已结束且尚未写出"""
+        row = self.conn.execute(
+            '''SELECT f.assembled, (SELECT COUNT(*) FROM jobs j
+                                    WHERE j.output_path = f.output_path AND j.status NOT IN ('done', 'failed'))
+               FROM files f WHERE f.output_path = ?''', (output_path,)
+        ).fetchone()
+        return row is not None and not row[0] and row[1] == 0
+
+    def ready_files(self) -> List[tuple]:
+        """全部任务都已结束却还没写出的文件 [(输出路径, 输入路径)]"""
+        return self.conn.execute(
+            '''SELECT f.output_path, f.input_path FROM files f
+               WHERE NOT f.assembled AND NOT EXISTS (SELECT 1 FROM jobs j WHERE j.output_path = f.output_path
+                                                     AND j.status NOT IN ('done', 'failed'))'''
+        ).fetchall()
+
+    def results(self, output_path: str) -> Dict[str, str]:
+        translations = {}
+        for (result,) in self.conn.execute(
+                "SELECT result FROM jobs WHERE output_path = ? AND status = 'done'", (output_path,)):
+            translations.update(json.loads(result))
+        return translations
+
+    def mark_assembled(self, output_path: str):
+        self.conn.execute('UPDATE files SET assembled = 1 WHERE output_path = ?', (output_path,))
+
+    def counts(self) -> Dict[str, int]:
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        counts.update(self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return counts
+
+    def close(self):
+        self.conn.close()
+
+
+def enqueue(job_queue: JobQueue, input_path: str, output_path: str = None, model: str = "deepseek-chat",
+            token_budget: int = 4000):
+    """协调者：把文件或目录拆成批次任务写入队列"""
+    for input_file, output_file in file_pairs(input_path, output_path):
+        with open(input_file, 'r', encoding='utf-8') as f:
+            items, _ = extract_items(json.load(f))
+        # 空白原文无需翻译，重建时保留原样
+        items = [item for item in items if item[1].strip()]
+        batches = pack_batches(items, token_budget, OUTPUT_BUDGET)
+        job_queue.add_file(os.path.abspath(input_file), os.path.abspath(output_file), model, batches)
+        print(f"{os.path.basename(input_file)}: {len(items)} 条，{len(batches)} 个任务")
+
+    counts = job_queue.counts()
+    print(f"\n队列 {job_queue.path}: 待处理 {counts['pending']}，进行中 {counts['leased']}，"
+          f"已完成 {counts['done']}，失败 {counts['failed']}")
+
+
+def assemble(job_queue: JobQueue, translator: SilksongTranslator, output_path: str, input_path: str):
+    """全部任务结束后重建并写出输出文件
+
+    save_json先写临时文件再替换；两个worker碰巧同时写出时内容相同，不会留下半截文件。
+    """
+    with open(input_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    _, refs = extract_items(data)
+    result = translator.rebuild_json_structure(data, job_queue.results(output_path), refs)
+
+    save_json(result, output_path)
+    snapshot_file = snapshot_path(output_path)
+    os.makedirs(os.path.dirname(snapshot_file), exist_ok=True)
+    shutil.copyfile(input_path, snapshot_file)
+    job_queue.mark_assembled(output_path)
+    print(f"翻译完成，保存到: {output_path}")
+
+
+async def run_worker(job_queue: JobQueue, translator: SilksongTranslator, owner: str,
+                     lease: float = 120.0, poll: float = 2.0):
+    """worker：不断认领任务并翻译，直到队列中没有未完成的任务
+
+    同时持有的任务数随并发控制器的上限变化，避免认领了却长时间排队、挡住其他worker。
+    """
+    active = set()
+    completed = 0
+
+    async def keep_lease(job: Dict):
+        while True:
+            await asyncio.sleep(lease / 3)
+            if not job_queue.renew(job['id'], owner, lease):
+                print(f"任务 {os.path.basename(job['output_path'])}#{job['batch']} 的租约已被接手")
+                return
+
+    async def process(job: Dict):
+        nonlocal completed
+        name = os.path.basename(job['output_path'])
+        renewer = asyncio.ensure_future(keep_lease(job))
+        try:
+            # 任务结束即移除其去重记录：worker长时间运行，且交还重试的任务必须重新请求
+            translations = await translator.translate_items(job['items'], job['model'],
+                                                            os.path.basename(job['input_path']),
+                                                            release_dedup=True)
+        finally:
+            renewer.cancel()
+        # 后端不可用或部分条目最终失败时不提交，交还队列重试（已译成的条目重试时可命中缓存）
+        missing = sum(1 for key, _ in job['items'] if key not in translations)
+        if missing:
+            status = job_queue.release(job['id'], owner)
+            if status == 'pending':
+                print(f"任务 {name}#{job['batch']} 有 {missing} 条未译成，交还队列重试")
+            elif status == 'failed':
+                print(f"任务 {name}#{job['batch']} 有 {missing} 条未译成，已达尝试上限，标记为失败")
+                if job_queue.file_ready(job['output_path']):
+                    assemble(job_queue, translator, job['output_path'], job['input_path'])
+            return
+        if not job_queue.complete(job['id'], owner, translations):
+            print(f"任务 {name}#{job['batch']} 已由其他worker完成，丢弃本次结果")
+            return
+        completed += 1
+        print(f"任务 {name}#{job['batch']} 完成: {len(translations)}/{len(job['items'])} 条目")
+        if job_queue.file_ready(job['output_path']):
+            assemble(job_queue, translator, job['output_path'], job['input_path'])
+
+    while True:
+        slots = sum(int(backend.limiter.limit) for backend in translator.router.backends) + 1
+        while len(active) < slots:
+            job = job_queue.claim(owner, lease)
+            if job is None:
+                break
+            active.add(asyncio.ensure_future(process(job)))
+
+        if not active:
+            counts = job_queue.counts()
+            if counts['pending'] + counts['leased'] == 0:
+                # 写出时出错（或负责写出的worker在写出前退出）的文件不会再被触发写出，退出前补上
+                for output_path, input_path in job_queue.ready_files():
+                    try:
+                        assemble(job_queue, translator, output_path, input_path)
+                    except Exception as e:
+                        print(f"写出失败 {os.path.basename(output_path)}: {e}")
+                break
+            # 其他worker持有的任务可能在租约过期后回到队列
+            await asyncio.sleep(poll)
+            continue
+
+        done, active = await asyncio.wait(active, timeout=poll, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None:
+                # 任务保持leased状态，租约过期后由任意worker重新认领
+                print(f"任务处理出错: {task.exception()}")
+
+    counts = job_queue.counts()
+    print(f"\nworker {owner} 退出: 本进程完成 {completed} 个任务；队列已完成 {counts['done']}，失败 {counts['failed']}")
+
+
+def queue_main(command: str, argv: List[str]):
+    """trans.py queue / worker 子命令入口"""
+    if command == 'queue':
+        parser = argparse.ArgumentParser(prog='trans.py queue', description="把文件或目录拆成批次任务写入队列")
+        parser.add_argument('input', help="输入文件或目录")
+        parser.add_argument('output', nargs='?', default=None, help="输出文件（目录模式下为输出目录）")
+        parser.add_argument('model', nargs='?', default="deepseek-v3.1", help="模型名称")
+        parser.add_argument('--queue', default=DEFAULT_QUEUE, help="队列文件路径")
+        parser.add_argument('--token-budget', type=int, default=4000, help="每个任务的输入token预算（默认4000）")
+        args = parser.parse_args(argv)
+
+        job_queue = JobQueue(args.queue)
+        try:
+            enqueue(job_queue, args.input, args.output, args.model, args.token_budget)
+        finally:
+            job_queue.close()
+        return
+
+    parser = argparse.ArgumentParser(prog='trans.py worker', description="从队列认领并翻译批次任务")
+    parser.add_argument('--queue', default=DEFAULT_QUEUE, help="队列文件路径")
+    parser.add_argument('--lease', type=float, default=120, help="任务租约秒数，worker失联超过此时间后任务被重新分配")
+    parser.add_argument('--worker-id', default=f"{socket.gethostname()}-{os.getpid()}", help="worker标识")
+    parser.add_argument('--max-attempts', type=int, default=3, help="单个任务最多尝试次数")
+    add_translator_arguments(parser)
+    args = parser.parse_args(argv)
+
+    job_queue = JobQueue(args.queue, max_attempts=args.max_attempts)
+    translator = create_translator(args)
+    try:
+        asyncio.run(run_worker(job_queue, translator, args.worker_id, args.lease))
+    finally:
+        close_translator(translator)
+        job_queue.close()
+
+
+if __name__ == '__main__':
+    import sys
+    queue_main(sys.argv[1] if len(sys.argv) > 1 else 'worker', sys.argv[2:])
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线模拟的 chat/completions 接口，用于不消耗API额度地测量翻译流程吞吐
+
+功能：
+1. 兼容 AsyncOpenAI(base_url="http://127.0.0.1:<端口>/v1") 的请求与返回格式（含流式SSE）
+2. 可配置延迟分布：固定、均匀、对数正态、指数，另加按条目计的生成耗时
+3. 按概率注入 429（带Retry-After）与 502，或在并发超出容量时返回 429
+4. 译文确定性回显：在原文前加前缀，便于校验结果
+5. 模拟服务商的前缀缓存：系统消息此前出现过时，usage中按64 token粒度报告缓存命中
+
+用法: python mock_server.py [--port 8765] [--latency lognormal:0.8,0.4] [--rate-429 0.05] [--rate-502 0.02]
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+# 与 trans.py 中 build_translation_prompt 的条目格式对应：「序号. key: 原文」
+ITEM_LINE = re.compile(r'^\d+\. (.+?): (.*)$', re.M)
+
+
+def parse_latency(spec: str, seed: int = 0):
+    """解析延迟分布描述，返回一个无参采样函数
+
+    - fixed:0.5             固定0.5秒
+    - uniform:0.2,1.0       均匀分布
+    - lognormal:0.8,0.4     对数正态（参数为中位数秒数与sigma）
+    - exp:0.5               指数分布（均值）
+    """
+    kind, _, params = spec.partition(':')
+    values = [float(v) for v in params.split(',') if v]
+    rng = random.Random(seed)
+
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == 'lognormal':
+        import math
+        mu = math.log(values[0])
+        return lambda: rng.lognormvariate(mu, values[1])
+    if kind == 'exp':
+        return lambda: rng.expovariate(1 / values[0])
+    raise ValueError(f"未知的延迟分布: {spec}")
+
+
+def estimate_tokens(text: str) -> int:
+    """与 trans.estimate_tokens 相同的粗略换算，用于填充usage"""
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return int(cjk * 0.6 + (len(text) - cjk) * 0.3) + 1
+
+
+class MockState:
+    """模拟服务的配置与计数器（多线程共享）"""
+
+    def __init__(self, latency: str = 'fixed:0.2', per_entry_latency: float = 0.0,
+                 rate_429: float = 0.0, rate_502: float = 0.0, retry_after: float = 1.0,
+                 capacity: int = 0, prefix: str = '译', seed: int = 0):
+        self.sample_latency = parse_latency(latency, seed)
+        self.per_entry_latency = per_entry_latency
+        self.rate_429 = rate_429
+        self.rate_502 = rate_502
+        self.retry_after = retry_after
+        self.capacity = capacity
+        self.prefix = prefix
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.seen_prefixes = set()
+        self.in_flight = 0
+        self.counters = {'requests': 0, 'ok': 0, 'rejected_429': 0, 'rejected_502': 0,
+                         'entries': 0, 'peak_in_flight': 0}
+
+    def admit(self):
+        """决定本次请求的结局：'ok'、429 或 502"""
+        with self.lock:
+            self.counters['requests'] += 1
+            if self.capacity and self.in_flight >= self.capacity:
+                self.counters['rejected_429'] += 1
+                return 429
+            roll = self.rng.random()
+            if roll < self.rate_429:
+                self.counters['rejected_429'] += 1
+                return 429
+            if roll < self.rate_429 + self.rate_502:
+                self.counters['rejected_502'] += 1
+                return 502
+            self.in_flight += 1
+            self.counters['peak_in_flight'] = max(self.counters['peak_in_flight'], self.in_flight)
+            return 'ok'
+
+    def cached_tokens(self, messages: List[Dict]) -> int:
+        """系统消息（固定前缀）此前出现过则视为命中缓存，按64 token取整"""
+        prefix = ''.join(m.get('content', '') for m in messages if m.get('role') == 'system')
+        if not prefix:
+            return 0
+        with self.lock:
+            hit = prefix in self.seen_prefixes
+            self.seen_prefixes.add(prefix)
+        return estimate_tokens(prefix) // 64 * 64 if hit else 0
+    
+    def finish(self, entries: int):
+        with self.lock:
+            self.in_flight -= 1
+            self.counters['ok'] += 1
+            self.counters['entries'] += entries
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return dict(self.counters, in_flight=self.in_flight)
+
+    def reset(self):
+        with self.lock:
+            for key in self.counters:
+                self.counters[key] = 0
+
+
+def build_reply(messages: List[Dict], prefix: str) -> List[Dict]:
+    """从最后一条用户消息中解析待翻译条目，生成确定性译文"""
+    prompt = next((m.get('content', '') for m in reversed(messages) if m.get('role') == 'user'), '')
+    return [{"key": key, "original": text, "translation": prefix + text}
+            for key, text in ITEM_LINE.findall(prompt)]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # 基准测试时不在终端刷访问日志
+        pass
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端取消了请求（如对冲请求落败），不打印堆栈
+            self.close_connection = True
+
+    def send_json(self, status: int, payload: Dict, headers: Dict = None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/stats'):
+            self.send_json(200, self.server.state.snapshot())
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        state = self.server.state
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+
+        verdict = state.admit()
+        if verdict == 429:
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                           {'Retry-After': f"{state.retry_after:g}"})
+            return
+        if verdict == 502:
+            time.sleep(state.sample_latency() / 4)
+            self.send_json(502, {"error": {"message": "Bad gateway", "type": "server_error"}})
+            return
+
+        entries = build_reply(request.get('messages', []), state.prefix)
+        try:
+            time.sleep(state.sample_latency() + state.per_entry_latency * len(entries))
+            content = json.dumps({"translations": entries}, ensure_ascii=False, indent=2)
+            prompt_text = ''.join(m.get('content', '') for m in request.get('messages', []))
+            usage = {"prompt_tokens": estimate_tokens(prompt_text),
+                     "completion_tokens": estimate_tokens(content)}
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            usage["prompt_tokens_details"] = {"cached_tokens": state.cached_tokens(request.get('messages', []))}
+
+            if request.get('stream'):
+                self.send_stream(request.get('model', 'mock'), content, usage)
+            else:
+                self.send_json(200, {
+                    "id": f"mock-{time.time_ns()}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get('model', 'mock'),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": usage,
+                })
+        finally:
+            state.finish(len(entries))
+
+    def send_stream(self, model: str, content: str, usage: Dict, chunk_size: int = 24):
+        """以SSE分片发送，模拟流式输出"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def emit(payload: str):
+            data = f"data: {payload}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+        created = int(time.time())
+        for i in range(0, len(content), chunk_size):
+            chunk = {"id": "mock-stream", "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": content[i:i + chunk_size]},
+                                  "finish_reason": None}]}
+            emit(json.dumps(chunk, ensure_ascii=False))
+        emit(json.dumps({"id": "mock-stream", "object": "chat.completion.chunk", "created": created,
+                         "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                         "usage": usage}))
+        emit("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start_server(state: MockState, host: str = '127.0.0.1', port: int = 0):
+    """在后台线程启动模拟服务，返回 (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.state = state
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    """模拟服务的命令行参数（基准脚本复用）"""
+    parser.add_argument('--latency', default='lognormal:0.8,0.4',
+                        help="每次请求的基础延迟分布，如 fixed:0.5、uniform:0.2,1.0、lognormal:0.8,0.4、exp:0.5")
+    parser.add_argument('--per-entry-latency', type=float, default=0.01, help="每条译文额外的生成耗时（秒）")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="随机返回429的概率")
+    parser.add_argument('--rate-502', type=float, default=0.0, help="随机返回502的概率")
+    parser.add_argument('--retry-after', type=float, default=1.0, help="429响应中Retry-After的秒数")
+    parser.add_argument('--capacity', type=int, default=0, help="同时处理的请求上限，超出返回429（0为不限）")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子")
+
+
+def state_from_args(args) -> MockState:
+    return MockState(latency=args.latency, per_entry_latency=args.per_entry_latency,
+                     rate_429=args.rate_429, rate_502=args.rate_502, retry_after=args.retry_after,
+                     capacity=args.capacity, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线模拟的chat/completions接口")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server, base_url = start_server(state_from_args(args), args.host, args.port)
+    print(f"模拟接口已启动: {base_url}")
+    print(f"使用方法: OPENAI_API_KEY=mock OPENAI_API_URL={base_url} python trans.py zhs/cards.json")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print(f"\n统计: {server.state.snapshot()}")
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
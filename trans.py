@@ -6,69 +6,1081 @@
 功能：
 1. 调用OpenAI API进行翻译
 2. 适配杀戮尖塔JSON格式
-3. 支持批量翻译
+3. 支持批量翻译，多批次并发发送（AIMD自适应并发）
+4. 本地SQLite翻译缓存，原文/模型/风格模板未变的条目不再重复请求
+5. 增量模式：对比上次的原文快照，只翻译新增或变更的条目
+6. 断点续跑：每完成一批即追加写入日志文件，中断后可用--resume跳过已完成批次
+7. 按token预算打包批次，避免长文本批次超出max_tokens被截断
+8. 相同原文（跨文件）只请求一次，译文回填到所有出现位置，术语译法保持一致
+9. 校验返回的key，只重新请求缺失或格式错误的条目；整批失败时对半拆分定位问题条目
+10. 可选流式输出：增量解析translations数组，每条译文闭合即写入日志与缓存
+11. 逐批次指标（排队、延迟、token用量、重试、解析耗时），输出JSONL与Prometheus快照
+12. 逐条校验格式标记：空格问题就地修复，丢失占位符的条目直接重新请求
+13. 多接口/多密钥路由：按观测延迟与错误率分配请求，连续429的接口暂时移出轮换
+14. 对冲请求：批次慢于近期延迟分位数时再发一份，先到者胜，统计对冲率与浪费的token
+15. 提示词固定部分作为逐字节相同的前缀，便于服务商前缀缓存命中，并统计缓存命中比例
+16. 低内存模式：超大文件逐项流式读取、分窗口翻译、按原顺序流式写出
+17. 译文台账：后台线程批量写入结构化JSONL，每个文件一份
+18. 任务队列模式：queue/worker子命令，多个进程共享SQLite队列，租约过期自动重新分配（见job_queue.py）
+19. plan子命令：离线估算请求数、token、费用与耗时，不需要API密钥，不写任何文件
 """
 
 import os
+import re
 import json
+import math
+import time
+import random
 import asyncio
+import hashlib
+import queue
 import logging
-from typing import Dict, List
+import threading
+import contextvars
+import shutil
+import sqlite3
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, List, Optional
 from pathlib import Path
-from openai import AsyncOpenAI
+from collections import Counter, deque
+
+from fix_keywords import AtomicFile, fix_keywords_in_text
+
+
+# 动态占位符与能量图标：丢失或多出会让游戏显示错误，译文必须与原文完全一致
+PLACEHOLDER_PATTERN = re.compile(r'![A-Za-z0-9_:]+!|\[[A-Z]\]|\{\d*\}|%[sd]')
+# 排版标记：NL换行、#y等高亮前缀、@/~特效包裹符；不一致时只记警告
+FORMAT_PATTERN = re.compile(r'NL|#[a-z]|[@~]')
+
+# 可重试的HTTP状态码：限流与网关类错误
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """解析Retry-After / retry-after-ms响应头，返回需等待的秒数"""
+    if not headers:
+        return None
+    try:
+        value = headers.get('retry-after-ms')
+        if value is not None:
+            return max(0.0, float(value) / 1000)
+        value = headers.get('retry-after')
+    except AttributeError:
+        return None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # HTTP日期格式
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(e: Exception) -> tuple:
+    """从异常中取出 (HTTP状态码, Retry-After秒数, 是否可重试)
+
+    连接失败与超时（APITimeoutError是APIConnectionError的子类）没有状态码，也都可重试：
+    客户端关闭了SDK内置重试，这类错误只能由call_openai_api重试。
+    """
+    # 走到这里时openai已在创建客户端时导入
+    from openai import APIConnectionError
+    
+    if isinstance(e, APIConnectionError):
+        return None, None, True
+    status = getattr(e, 'status_code', None)
+    retry_after = parse_retry_after(getattr(getattr(e, 'response', None), 'headers', None))
+    if status is not None:
+        is_retryable = status in RETRYABLE_STATUS
+    else:
+        error_msg = str(e)
+        is_retryable = any(code in error_msg for code in ['502', '503', '504', '429', 'timeout', 'connection'])
+    return status, retry_after, is_retryable
+
+
+# 离线token估算系数（参考DeepSeek官方换算：1个中文字符≈0.6 token，1个英文字符≈0.3 token）
+CJK_TOKENS_PER_CHAR = 0.6
+OTHER_TOKENS_PER_CHAR = 0.3
+# 每条译文输出中 {"key": ..., "original": ..., "translation": ...} 的结构开销
+OUTPUT_TOKENS_PER_ENTRY = 16
+# 译文长度相对原文的放大系数，留出余量
+TRANSLATION_EXPANSION = 1.3
+# 每次请求的max_tokens；输出只按其八成打包，给估算误差留余量，避免JSON被截断
+MAX_TOKENS = 12000
+OUTPUT_BUDGET = int(MAX_TOKENS * 0.8)
+
+
+def estimate_tokens(text) -> int:
+    """按字符类别粗略估算token数，无需联网或分词器"""
+    if not isinstance(text, str):
+        text = json.dumps(text, ensure_ascii=False)
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return int(cjk * CJK_TOKENS_PER_CHAR + (len(text) - cjk) * OTHER_TOKENS_PER_CHAR) + 1
+
+
+def estimate_item_tokens(key: str, text) -> tuple:
+    """估算一条待翻译内容的 (输入token, 输出token)；输出含key、原文回显与译文"""
+    key_tokens = estimate_tokens(key)
+    text_tokens = estimate_tokens(text)
+    return (key_tokens + text_tokens + 4,
+            key_tokens + int(text_tokens * (1 + TRANSLATION_EXPANSION)) + OUTPUT_TOKENS_PER_ENTRY)
+
+
+def pack_batches(items: List[tuple], token_budget: int, max_output_tokens: int,
+                 max_items: int = 200) -> List[List[tuple]]:
+    """按token预算贪心打包批次
+
+    - 每批待翻译内容的输入token不超过token_budget
+    - 估算的输出token（key + 原文回显 + 译文）不超过max_output_tokens
+    - 单条超出预算的条目独占一批
+    """
+    batches = []
+    current, input_tokens, output_tokens = [], 0, 0
+    for key, text in items:
+        item_input, item_output = estimate_item_tokens(key, text)
+        
+        if current and (input_tokens + item_input > token_budget
+                        or output_tokens + item_output > max_output_tokens
+                        or len(current) >= max_items):
+            batches.append(current)
+            current, input_tokens, output_tokens = [], 0, 0
+        current.append((key, text))
+        input_tokens += item_input
+        output_tokens += item_output
+    if current:
+        batches.append(current)
+    return batches
+
+
+def copy_json_tree(node, copies: Dict[int, object]):
+    """复制JSON容器结构，copies记录 id(原容器) -> 新容器
+
+    先整体浅拷贝，再只对子容器递归；字符串等不可变值直接共享。
+    """
+    if isinstance(node, dict):
+        new_node = dict(node)
+        copies[id(node)] = new_node
+        for key, value in node.items():
+            if isinstance(value, (dict, list)):
+                new_node[key] = copy_json_tree(value, copies)
+        return new_node
+    if isinstance(node, list):
+        new_node = list(node)
+        copies[id(node)] = new_node
+        for i, value in enumerate(node):
+            if isinstance(value, (dict, list)):
+                new_node[i] = copy_json_tree(value, copies)
+        return new_node
+    return node
+
+
+# 输出格式说明（prompt.md未写明时附加到系统提示中）
+OUTPUT_FORMAT_PROMPT = """请按照以下JSON格式输出翻译结果：
+{
+  "translations": [
+    {"key": "原始key", "original": "原文", "translation": "丝之歌译文"},
+    ...
+  ]
+}
+
+要求：
+1. 严格按照JSON格式输出
+2. 保持key不变
+3. 译文字数与原文大体一致
+4. 保持游戏格式标记（如NL、!D!、[G]等）"""
+
+class AdaptiveConcurrency:
+    """AIMD自适应并发控制
+
+    - 每个成功请求使上限加性增长（约每轮往返+1）
+    - 遇到429/5xx时上限乘性下降，同一拥塞窗口内只下降一次
+    - 带Retry-After时全局暂停派发新请求直到等待结束
+    """
+
+    def __init__(self, initial: int = 4, min_limit: int = 1, max_limit: int = 32,
+                 increase: float = 1.0, decrease: float = 0.5):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.increase = increase
+        self.decrease = decrease
+        self.in_flight = 0
+        self._cond = None
+        self._cond_loop = None
+        self._pause_until = 0.0
+        self._last_decrease = 0.0
+
+    def _condition(self) -> asyncio.Condition:
+        """在当前运行的事件循环中创建条件变量
+
+        翻译器在asyncio.run之前创建；Python 3.9及以前的Condition构造时就绑定默认循环，
+        提前创建会在有竞争时报 attached to a different loop。
+        """
+        loop = asyncio.get_running_loop()
+        if self._cond_loop is not loop:
+            self._cond = asyncio.Condition()
+            self._cond_loop = loop
+        return self._cond
+    
+    async def acquire(self):
+        """等待并占用一个并发名额"""
+        while True:
+            delay = self._pause_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            cond = self._condition()
+            async with cond:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                await cond.wait()
+
+    async def release(self):
+        """归还并发名额"""
+        cond = self._condition()
+        async with cond:
+            self.in_flight -= 1
+            cond.notify_all()
+
+    def on_success(self):
+        """加性增：每个成功请求增加 increase/limit"""
+        self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+
+    def on_throttle(self, retry_after: float = None):
+        """乘性减：限流或服务端错误时收缩并发上限"""
+        now = time.monotonic()
+        # 同一拥塞窗口内的多个失败只算一次，避免并发请求把上限连续砍到底
+        window = max(retry_after or 0.0, 1.0)
+        if now - self._last_decrease >= window:
+            self.limit = max(self.min_limit, self.limit * self.decrease)
+            self._last_decrease = now
+        if retry_after:
+            self.pause(retry_after)
+    
+    def has_slot(self) -> bool:
+        """当前能否立即派发：未暂停且还有空闲名额"""
+        return self._pause_until <= time.monotonic() and self.in_flight < int(self.limit)
+    
+    def try_acquire(self) -> bool:
+        """不等待地占用一个并发名额；暂停中或名额已满时返回False"""
+        if not self.has_slot():
+            return False
+        self.in_flight += 1
+        return True
+    
+    @property
+    def pause_until(self) -> float:
+        """暂停派发结束的时刻（time.monotonic）"""
+        return self._pause_until
+    
+    def pause(self, seconds: float):
+        """在seconds秒内暂停派发新请求（已在途的请求不受影响）"""
+        self._pause_until = max(self._pause_until, time.monotonic() + seconds)
+
+
+class Backend:
+    """一个 (接口, 密钥, 模型) 后端，带独立的AIMD并发控制与延迟/错误率统计"""
+
+    def __init__(self, name: str, client, model: str = None, weight: float = 1.0,
+                 limiter: AdaptiveConcurrency = None):
+        self.name = name
+        self.client = client
+        self.model = model  # 为None时使用调用方传入的模型名
+        self.weight = weight
+        self.limiter = limiter or AdaptiveConcurrency()
+        self.latency = None      # 成功请求延迟的指数加权平均（秒）
+        self.error_rate = 0.0    # 失败率的指数加权平均
+        self.consecutive_429 = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+
+class BackendRouter:
+    """按观测延迟与错误率在多个后端间分配请求
+
+    - 得分 = 平均延迟 × (1 + 在途数/并发上限) ÷ 成功率，按 权重/得分 加权随机选择
+    - 连续cooldown_after次429的后端移出轮换cooldown秒（至少为Retry-After）
+    - 批次拿到并发名额的那一刻才选定后端，排队期间进入冷却的后端不会再分到排队中的批次
+    """
+
+    def __init__(self, backends: List[Backend], alpha: float = 0.2,
+                 cooldown_after: int = 3, cooldown: float = 30.0):
+        if not backends:
+            raise ValueError("至少需要一个后端")
+        self.backends = backends
+        self.alpha = alpha
+        self.cooldown_after = cooldown_after
+        self.cooldown = cooldown
+        self.rng = random.Random()
+        self._cond = None
+        self._cond_loop = None
+    
+    def _condition(self) -> asyncio.Condition:
+        """在当前运行的事件循环中创建条件变量（原因同AdaptiveConcurrency._condition）"""
+        loop = asyncio.get_running_loop()
+        if self._cond_loop is not loop:
+            self._cond = asyncio.Condition()
+            self._cond_loop = loop
+        return self._cond
+    
+    def available(self, exclude: Backend = None) -> List[Backend]:
+        now = time.monotonic()
+        return [b for b in self.backends if b.cooldown_until <= now and b is not exclude]
+    
+    def _score(self, backend: Backend, default_latency: float) -> float:
+        latency = backend.latency if backend.latency is not None else default_latency
+        load = 1 + backend.limiter.in_flight / max(backend.limiter.limit, 1)
+        return latency * load / max(0.05, 1 - backend.error_rate)
+    
+    def _choose(self, candidates: List[Backend]) -> Backend:
+        if len(candidates) == 1:
+            return candidates[0]
+        known = [b.latency for b in self.backends if b.latency is not None]
+        default_latency = sum(known) / len(known) if known else 1.0
+        weights = [b.weight / self._score(b, default_latency) for b in candidates]
+        return self.rng.choices(candidates, weights=weights)[0]
+    
+    async def acquire(self, exclude: Backend = None) -> Backend:
+        """等到某个不在冷却中的后端有空闲并发名额，占用该名额并返回这个后端
+
+        exclude用于重试时优先换一个后端，其他后端都在冷却时才回到它。
+        有名额归还、冷却或Retry-After暂停结束时重新挑选，全部冷却时等到最早恢复的那个。
+        """
+        cond = self._condition()
+        async with cond:
+            while True:
+                candidates = self.available(exclude) or self.available()
+                ready = [b for b in candidates if b.limiter.has_slot()]
+                if ready:
+                    backend = self._choose(ready)
+                    backend.limiter.try_acquire()
+                    return backend
+                
+                now = time.monotonic()
+                wake = [b.cooldown_until for b in self.backends if b.cooldown_until > now]
+                wake += [b.limiter.pause_until for b in candidates if b.limiter.pause_until > now]
+                timeout = min(wake) - now if wake else None
+                try:
+                    await asyncio.wait_for(cond.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+    
+    async def release(self, backend: Backend):
+        """归还backend的并发名额，唤醒等待派发的批次"""
+        await backend.limiter.release()
+        cond = self._condition()
+        async with cond:
+            cond.notify_all()
+    
+    def report_success(self, backend: Backend, latency: float):
+        backend.requests += 1
+        backend.consecutive_429 = 0
+        backend.error_rate *= (1 - self.alpha)
+        if backend.latency is None:
+            backend.latency = latency
+        else:
+            backend.latency += self.alpha * (latency - backend.latency)
+    
+    def report_failure(self, backend: Backend, status: int = None, retry_after: float = None):
+        backend.requests += 1
+        backend.failures += 1
+        backend.error_rate += self.alpha * (1 - backend.error_rate)
+        if status == 429:
+            backend.consecutive_429 += 1
+            if backend.consecutive_429 >= self.cooldown_after:
+                cooldown = max(self.cooldown, retry_after or 0)
+                backend.cooldown_until = time.monotonic() + cooldown
+                backend.consecutive_429 = 0
+                # 全部后端都在冷却时acquire会等到冷却结束再派发给它
+                backend.limiter.pause(cooldown)
+                if len(self.backends) > 1:
+                    print(f"后端 {backend.name} 连续限流，暂停 {cooldown:.0f} 秒")
+        else:
+            backend.consecutive_429 = 0
+    
+    def summary(self) -> List[Dict]:
+        return [{'name': b.name, 'requests': b.requests, 'failures': b.failures,
+                 'latency': b.latency, 'error_rate': b.error_rate, 'limit': b.limiter.limit}
+                for b in self.backends]
+
+
+def load_backends(path: str) -> List[Dict]:
+    """读取后端配置文件
+
+    JSON列表，每项形如 {"name": "ds-1", "url": "https://api.deepseek.com", "api_key_env": "DEEPSEEK_KEY_1",
+    "model": "deepseek-chat", "weight": 1, "concurrency": 4, "max_concurrency": 32}；
+    密钥可直接写api_key，推荐用api_key_env从环境变量读取。
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        configs = json.load(f)
+    if not isinstance(configs, list) or not configs:
+        raise ValueError(f"后端配置应为非空JSON列表: {path}")
+    for i, config in enumerate(configs):
+        if not config.get('api_key') and config.get('api_key_env'):
+            config['api_key'] = os.getenv(config['api_key_env'])
+        if not config.get('api_key'):
+            raise ValueError(f"后端 {config.get('name', i)} 缺少api_key（或api_key_env对应的环境变量未设置）")
+    return configs
+
+
+class TranslationCache:
+    """基于SQLite的持久化翻译缓存
+
+    以 (原文, 模型, 风格模板, temperature) 的哈希为键，
+    超出容量上限时按最近使用时间淘汰。
+    """
+
+    def __init__(self, path: str = 'silksong_test/translation_cache.sqlite', max_bytes: int = 256 * 1024 * 1024,
+                 readonly: bool = False):
+        self.path = path
+        self.readonly = readonly
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        
+        if readonly:
+            # 只读打开（plan命令）：不创建目录与表，也不更新最近使用时间
+            self.conn = sqlite3.connect(Path(path).resolve().as_uri() + '?mode=ro', uri=True)
+            return
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS translations (
+                   hash TEXT PRIMARY KEY,
+                   model TEXT NOT NULL,
+                   source TEXT NOT NULL,
+                   translation TEXT NOT NULL,
+                   size INTEGER NOT NULL,
+                   last_used REAL NOT NULL
+               )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON translations(last_used)")
+        self.conn.commit()
+        # 已用字节数在内存中累计，写入时不必每次全表求和
+        self.bytes_used = self.total_bytes()
+    
+    @staticmethod
+    def make_key(text, model: str, base_prompt: str, temperature: float) -> str:
+        """计算缓存键：任一输入变化都会得到新键"""
+        payload = json.dumps([text, model, base_prompt, temperature], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        """批量查询，返回命中的 {缓存键: 译文}"""
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        # SQLite单条语句的参数个数有限，分段查询
+        for i in range(0, len(unique), 500):
+            chunk = unique[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT hash, translation FROM translations WHERE hash IN ({placeholders})", chunk
+            ).fetchall()
+            found.update(rows)
+        
+        if found and not self.readonly:
+            now = time.time()
+            self.conn.executemany("UPDATE translations SET last_used = ? WHERE hash = ?",
+                                  [(now, key) for key in found])
+            self.conn.commit()
+        
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+    
+    def put_many(self, entries: List[tuple]):
+        """批量写入 (缓存键, 模型, 原文, 译文)，写入后按容量淘汰"""
+        if not entries:
+            return
+        now = time.time()
+        rows = []
+        for key, model, source, translation in entries:
+            source_text = source if isinstance(source, str) else json.dumps(source, ensure_ascii=False)
+            size = len(source_text.encode('utf-8')) + len(translation.encode('utf-8'))
+            rows.append((key, model, source_text, translation, size, now))
+        replaced = self._sizes([row[0] for row in rows])
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO translations (hash, model, source, translation, size, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+        self.conn.commit()
+        self.writes += len(rows)
+        # 同一批内重复的键只有最后一行生效
+        self.bytes_used += sum({row[0]: row[4] for row in rows}.values()) - sum(replaced.values())
+        if self.bytes_used > self.max_bytes:
+            self.evict()
+    
+    def _sizes(self, keys: List[str]) -> Dict[str, int]:
+        """已存在条目的 {缓存键: 大小}，用于覆盖写入时修正累计字节数"""
+        sizes = {}
+        unique = list(dict.fromkeys(keys))
+        for i in range(0, len(unique), 500):
+            chunk = unique[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            sizes.update(self.conn.execute(
+                f"SELECT hash, size FROM translations WHERE hash IN ({placeholders})", chunk
+            ).fetchall())
+        return sizes
+    
+    def total_bytes(self) -> int:
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM translations").fetchone()[0]
+    
+    def evict(self):
+        """超出容量上限时删除最久未使用的条目，降到上限的90%"""
+        # 其他进程（如队列worker）可能也在写同一缓存，淘汰前重新求一次准确总量
+        total = self.bytes_used = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        doomed = []
+        for key, size in self.conn.execute("SELECT hash, size FROM translations ORDER BY last_used"):
+            if total <= target:
+                break
+            doomed.append((key,))
+            total -= size
+        self.conn.executemany("DELETE FROM translations WHERE hash = ?", doomed)
+        self.conn.commit()
+        self.evictions += len(doomed)
+        self.bytes_used = total
+    
+    def stats(self) -> Dict:
+        """命中/未命中等统计信息"""
+        lookups = self.hits + self.misses
+        entries = self.conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'writes': self.writes,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': self.total_bytes(),
+        }
+    
+    def close(self):
+        self.conn.close()
+
+
+# 当前正在翻译的 (文件名, 批次号)，由translate_file设置，供指标记录使用
+current_batch = contextvars.ContextVar('current_batch', default=('', 0))
+
+
+def read_usage(usage) -> Dict[str, int]:
+    """从response.usage中取出token用量，兼容OpenAI与DeepSeek的缓存命中字段"""
+    if usage is None:
+        return {}
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached = getattr(details, 'cached_tokens', None) if details is not None else None
+    if cached is None:
+        cached = getattr(usage, 'prompt_cache_hit_tokens', None)
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+        'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0,
+        'cached_tokens': cached or 0,
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近秩法求百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = math.ceil(q / 100 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+class MetricsRecorder:
+    """逐批次API调用指标
+
+    每次请求（含其重试）记一条，实时追加到JSONL；结束时写出Prometheus文本快照并打印分位数汇总。
+    """
+
+    TIMINGS = ('queue_wait', 'latency', 'first_token', 'parse_time')
+    TOKENS = ('prompt_tokens', 'completion_tokens', 'cached_tokens', 'wasted_tokens')
+    ENTRIES = ('sent', 'returned', 'valid')
+
+    def __init__(self, jsonl_path: str = None, prometheus_path: str = None):
+        self.records = []
+        self.prometheus_path = prometheus_path
+        self.file = None
+        if jsonl_path:
+            metrics_dir = os.path.dirname(jsonl_path)
+            if metrics_dir:
+                os.makedirs(metrics_dir, exist_ok=True)
+            self.file = open(jsonl_path, 'a', encoding='utf-8')
+    
+    def record(self, stats: Dict):
+        self.records.append(stats)
+        if self.file is not None:
+            self.file.write(json.dumps(stats, ensure_ascii=False) + '\n')
+            self.file.flush()
+    
+    def _values(self, name: str) -> List[float]:
+        return [r[name] for r in self.records if r.get(name) is not None]
+    
+    def cache_hit_ratio(self) -> float:
+        """输入token中命中服务商前缀缓存的比例"""
+        prompt_tokens = sum(self._values('prompt_tokens'))
+        return sum(self._values('cached_tokens')) / prompt_tokens if prompt_tokens else 0.0
+    
+    def prometheus_text(self) -> str:
+        """生成Prometheus文本格式快照"""
+        lines = []
+        statuses = {}
+        for r in self.records:
+            statuses[r.get('status', 'ok')] = statuses.get(r.get('status', 'ok'), 0) + 1
+        lines.append('# TYPE silksong_batches_total counter')
+        for status, count in sorted(statuses.items()):
+            lines.append(f'silksong_batches_total{{status="{status}"}} {count}')
+        
+        for name in self.TIMINGS:
+            values = self._values(name)
+            metric = f'silksong_{name}_seconds'
+            lines.append(f'# TYPE {metric} summary')
+            for q in (0.5, 0.95, 0.99):
+                lines.append(f'{metric}{{quantile="{q}"}} {percentile(values, q * 100):.6f}')
+            lines.append(f'{metric}_sum {sum(values):.6f}')
+            lines.append(f'{metric}_count {len(values)}')
+        
+        lines.append('# TYPE silksong_tokens_total counter')
+        for name in self.TOKENS:
+            kind = name.replace('_tokens', '')
+            lines.append(f'silksong_tokens_total{{kind="{kind}"}} {sum(self._values(name))}')
+        lines.append('# TYPE silksong_prompt_cache_hit_ratio gauge')
+        lines.append(f'silksong_prompt_cache_hit_ratio {self.cache_hit_ratio():.6f}')
+        lines.append('# TYPE silksong_entries_total counter')
+        for name in self.ENTRIES:
+            lines.append(f'silksong_entries_total{{kind="{name}"}} {sum(self._values(name))}')
+        lines.append('# TYPE silksong_retries_total counter')
+        lines.append(f'silksong_retries_total {sum(self._values("retries"))}')
+        lines.append('# TYPE silksong_hedges_total counter')
+        hedged = [r for r in self.records if r.get('hedged')]
+        won = sum(1 for r in hedged if r.get('hedge_won'))
+        lines.append(f'silksong_hedges_total{{winner="hedge"}} {won}')
+        lines.append(f'silksong_hedges_total{{winner="primary"}} {len(hedged) - won}')
+        return '\n'.join(lines) + '\n'
+    
+    def write_prometheus(self):
+        if not self.prometheus_path:
+            return
+        with AtomicFile(self.prometheus_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+    
+    def print_summary(self):
+        """打印本次运行的分位数汇总"""
+        if not self.records:
+            return
+        print(f"\n批次指标（共 {len(self.records)} 次请求）:")
+        print(f"  {'指标':<14}{'p50':>9}{'p95':>9}{'p99':>9}{'合计':>10}")
+        for name in self.TIMINGS:
+            values = self._values(name)
+            if values:
+                print(f"  {name:<14}{percentile(values, 50):>9.3f}{percentile(values, 95):>9.3f}"
+                      f"{percentile(values, 99):>9.3f}{sum(values):>10.1f}")
+        tokens = {name: sum(self._values(name)) for name in self.TOKENS}
+        entries = {name: sum(self._values(name)) for name in self.ENTRIES}
+        print(f"  token: 输入 {tokens['prompt_tokens']}（前缀缓存命中 {tokens['cached_tokens']}，"
+              f"占 {self.cache_hit_ratio():.1%}），输出 {tokens['completion_tokens']}")
+        print(f"  条目: 发送 {entries['sent']}，返回 {entries['returned']}，有效 {entries['valid']}；"
+              f"重试 {sum(self._values('retries'))} 次")
+    
+    def close(self):
+        self.write_prometheus()
+        if self.file is not None:
+            self.file.close()
+
+
+class TranslationLedger:
+    """译文台账：每条译文一行结构化JSONL，每个任务（输入文件）一份
+
+    record()只把元组放入队列，序列化与写盘由后台线程完成，不占用事件循环；
+    后台线程每次取空队列后批量写入并flush，多个文件并发翻译时各写各的文件。
+    """
+
+    def __init__(self, directory: str = 'silksong_test/ledger'):
+        self.directory = directory
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.sinks = {}  # 任务名 -> 文件对象，只在后台线程中访问
+        self.records = 0
+    
+    def record(self, job: str, key: str, source: str, translation: str, model: str,
+               batch: Optional[int] = None, origin: str = 'api'):
+        """记录一条译文；origin为api、cache、journal、incremental或dedup"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='translation-ledger', daemon=True)
+            self.thread.start()
+        self.queue.put((job, time.time(), key, source, translation, model, batch, origin))
+    
+    def sink_path(self, job: str) -> str:
+        return os.path.join(self.directory, os.path.splitext(job)[0] + '.jsonl')
+    
+    def _run(self):
+        stop = False
+        while not stop:
+            items = [self.queue.get()]
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            lines = {}
+            for item in items:
+                if item is None:
+                    stop = True
+                    continue
+                job, timestamp, key, source, translation, model, batch, origin = item
+                lines.setdefault(job, []).append(json.dumps({
+                    'time': round(timestamp, 3), 'file': job, 'key': key, 'source': source,
+                    'translation': translation, 'model': model, 'batch': batch, 'origin': origin
+                }, ensure_ascii=False) + '\n')
+            
+            for job, chunk in lines.items():
+                sink = self.sinks.get(job)
+                if sink is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    sink = self.sinks[job] = open(self.sink_path(job), 'a', encoding='utf-8')
+                sink.write(''.join(chunk))
+                sink.flush()
+                self.records += len(chunk)
+    
+    def close(self):
+        """写完队列中剩余的记录并关闭所有文件"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        for sink in self.sinks.values():
+            sink.close()
+        self.sinks.clear()
+
+
+class TranslationStreamParser:
+    """增量解析流式返回的 {"translations": [{...}, {...}]}
+
+    每喂入一段文本，返回其中新闭合的条目对象；已解析的部分即时丢弃，
+    内存只保留尚未闭合的那一个对象。
+    """
+
+    ARRAY_START = re.compile(r'"translations"\s*:\s*\[')
+
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0
+        self.in_array = False
+        self.done = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.obj_start = None
+    
+    def feed(self, chunk: str) -> List[Dict]:
+        """喂入一段文本，返回新闭合的条目"""
+        self.buffer += chunk
+        if self.done:
+            return []
+        if not self.in_array:
+            match = self.ARRAY_START.search(self.buffer)
+            if not match:
+                return []
+            self.in_array = True
+            self.buffer = self.buffer[match.end():]
+            self.pos = 0
+        
+        entries = []
+        buffer = self.buffer
+        i = self.pos
+        while i < len(buffer):
+            ch = buffer[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch == '{':
+                if self.depth == 0:
+                    self.obj_start = i
+                self.depth += 1
+            elif ch == '}' and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    try:
+                        entries.append(json.loads(buffer[self.obj_start:i + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self.obj_start = None
+            elif ch == ']' and self.depth == 0:
+                self.done = True
+                break
+            i += 1
+        
+        # 丢弃已解析部分，只保留未闭合的对象
+        if self.obj_start is not None:
+            self.buffer = buffer[self.obj_start:]
+            self.pos = i - self.obj_start
+            self.obj_start = 0
+        else:
+            self.buffer = ''
+            self.pos = 0
+        return entries
+
+
+class TranslationJournal:
+    """追加写入的批次日志，用于崩溃后断点续跑
+
+    每完成一个批次写入一行JSON并立即落盘；进程中途退出时最多丢失正在进行的批次。
+    completed只在续跑时由load()填充，本次运行记录的批次只写文件，内存占用不随文件大小增长。
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.completed = {}  # key -> (原文, 译文)
+        journal_dir = os.path.dirname(path)
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok=True)
+        
+        if resume:
+            self.completed = self.load(path)
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+    
+    @staticmethod
+    def load(path: str) -> Dict[str, tuple]:
+        """读取已完成批次；崩溃时写了一半的末行直接忽略"""
+        completed = {}
+        if not os.path.exists(path):
+            return completed
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                for key, source, translation in record.get('entries', []):
+                    completed[key] = (source, translation)
+        return completed
+    
+    def record(self, batch_no: int, entries: List[tuple]):
+        """记录一个完成的批次，entries为 (key, 原文, 译文) 列表"""
+        if not entries:
+            return
+        line = json.dumps({'batch': batch_no, 'time': time.time(), 'entries': entries}, ensure_ascii=False)
+        self.file.write(line + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+    
+    def close(self, remove: bool = False):
+        """关闭日志；整个文件已成功写出时可删除"""
+        self.file.close()
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
 
 
 class SilksongTranslator:
-    def __init__(self, api_key: str = None, api_url: str = None):
+    def __init__(self, api_key: str = None, api_url: str = None,
+                 concurrency: int = 4, max_concurrency: int = 32,
+                 cache: Optional[TranslationCache] = None, token_budget: int = 4000,
+                 stream: bool = False, metrics: Optional[MetricsRecorder] = None,
+                 backends: List[Dict] = None, hedge_percentile: float = 0,
+                 ledger: Optional[TranslationLedger] = None):
         """
         初始化翻译器
         
         Args:
             api_key: OpenAI API密钥，如果为None则从环境变量读取
             api_url: API接口URL
+            concurrency: 初始并发批次数
+            max_concurrency: 并发批次数上限（AIMD调整不会超过此值）
+            cache: 翻译缓存，为None时不使用缓存
+            token_budget: 每批待翻译内容的输入token预算
+            stream: 是否使用流式输出，边生成边解析、边写入
+            metrics: 逐批次指标记录器，为None时不记录
+            backends: 多后端配置（见load_backends），给出时忽略api_key/api_url
+            hedge_percentile: 对冲请求的延迟分位数（如95），0为关闭；仅对非流式请求生效
+            ledger: 译文台账，为None时不记录
         """
-        self.api_key = api_key or os.getenv('OPENAI_API_KEY')
-        self.api_url = api_url or os.getenv('OPENAI_API_URL')
-
-        print(self.api_url)
+        self.backends = backends
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        if backends:
+            self.api_key = backends[0]['api_key']
+            self.api_url = backends[0].get('url')
+        else:
+            self.api_key = api_key or os.getenv('OPENAI_API_KEY')
+            self.api_url = api_url or os.getenv('OPENAI_API_URL')
+        # 客户端在第一次请求时才创建（见router），plan等离线命令不需要API密钥，也不导入openai
+        self._router = None
         
-        if not self.api_key:
-            raise ValueError("需要提供API密钥，请设置环境变量OPENAI_API_KEY或传入api_key参数")
+        self.token_budget = token_budget
+        self.max_tokens = MAX_TOKENS
+        self.output_budget = OUTPUT_BUDGET
+        self.temperature = 1.2
+        self.cache = cache
+        self.stream = stream
+        self.metrics = metrics
+        self.ledger = ledger
         
-        self.client = AsyncOpenAI(
-            api_key=self.api_key,
-            base_url=self.api_url
-        )
+        # 跨文件去重：同一原文在本次任务中只请求一次
+        self._dedup_futures = {}  # (模型, 原文) -> Future[译文或None]
+        self.dedup_saved = 0
+        
+        # 请求统计
+        self.api_calls = 0
+        self.api_requests = 0
+        self.api_retries = 0
+        
+        # 对冲请求：主请求慢于近期延迟的该分位数时再发一份，0为关闭
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = 20
+        self.recent_latencies = deque(maxlen=200)
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedge_wasted_tokens = 0
         
-        self.batch_size = 100  # 简化批次大小
+        # 部分失败恢复统计
+        self.rerequested_entries = 0
+        self.failed_keys = []
         
-        # 配置日志系统
+        # 格式标记校验统计
+        self.marker_repairs = 0
+        self.marker_rejections = 0
+        self.marker_warnings = 0
+        
+        # 配置日志系统（日志文件在第一次写入时才创建）
+        self._logger = None
+        self._custom_logger = False
         self.setup_logging()
         
         # 加载翻译风格模板
         self.load_prompt_template()
     
-    def setup_logging(self, input_file: str = None):
-        """配置日志系统"""
-        # 创建logger
-        self.logger = logging.getLogger('SilksongTranslator')
-        self.logger.setLevel(logging.INFO)
+    @property
+    def router(self) -> BackendRouter:
+        """后端路由器，第一次访问时创建"""
+        if self._router is None:
+            self._router = self.create_router()
+        return self._router
+    
+    @property
+    def client(self):
+        """单后端时的快捷引用"""
+        return self.router.backends[0].client
+    
+    @property
+    def limiter(self) -> AdaptiveConcurrency:
+        """单后端时的快捷引用"""
+        return self.router.backends[0].limiter
+    
+    def create_router(self) -> BackendRouter:
+        """导入openai并为每个后端创建客户端"""
+        from openai import DefaultAsyncHttpxClient
+        
+        if not self.backends:
+            print(self.api_url)
+            
+            if not self.api_key:
+                raise ValueError("需要提供API密钥，请设置环境变量OPENAI_API_KEY或传入api_key参数")
         
-        # 清除已有的处理器
-        self.logger.handlers.clear()
+        # 所有后端共用一个HTTP连接池
+        self.http_client = DefaultAsyncHttpxClient()
         
-        # 创建silksong_test目录（如果不存在）
-        os.makedirs('silksong_test', exist_ok=True)
+        if self.backends:
+            return BackendRouter([
+                Backend(
+                    name=config.get('name') or config.get('url') or f"backend-{i}",
+                    client=self.make_client(config['api_key'], config.get('url')),
+                    model=config.get('model'),
+                    weight=config.get('weight', 1.0),
+                    limiter=AdaptiveConcurrency(initial=config.get('concurrency', self.concurrency),
+                                                max_limit=config.get('max_concurrency', self.max_concurrency))
+                )
+                for i, config in enumerate(self.backends)
+            ])
+        return BackendRouter([
+            Backend(name=self.api_url or 'default', client=self.make_client(self.api_key, self.api_url),
+                    limiter=AdaptiveConcurrency(initial=self.concurrency, max_limit=self.max_concurrency))
+        ])
+    
+    def served_model(self, model: str) -> str:
+        """实际应答请求的模型名，作为缓存、去重与台账的键
+
+        后端配置了model时请求发给该模型而不是命令行指定的model；
+        池中各后端的模型不一致时无法区分译文出自哪个模型，直接报错。
+        """
+        if not self.backends:
+            return model
+        models = {config.get('model') or model for config in self.backends}
+        if len(models) > 1:
+            raise ValueError(f"后端池中的模型不一致（{', '.join(sorted(models))}），"
+                             f"缓存与去重无法区分译文来源，请按模型拆成多次运行")
+        return models.pop()
+    
+    def make_client(self, api_key: str, api_url: str = None) -> 'AsyncOpenAI':
+        """创建共用连接池的API客户端"""
+        from openai import AsyncOpenAI
         
+        return AsyncOpenAI(
+            api_key=api_key,
+            base_url=api_url,
+            http_client=self.http_client,
+            # 重试由call_openai_api负责，SDK内置重试会让并发控制器看不到429
+            max_retries=0
+        )
+    
+    def setup_logging(self, input_file: str = None):
+        """配置日志文件路径（格式警告等；逐条译文记录在译文台账中）
+
+        目录与日志文件在第一次写日志时才创建；已创建logger时立即换成新文件。
+        """
         # 根据输入文件名生成日志文件名
         if input_file:
             log_filename = os.path.splitext(os.path.basename(input_file))[0] + '.log'
-            log_path = f'silksong_test/{log_filename}'
+            self.log_path = f'silksong_test/{log_filename}'
         else:
-            log_path = 'silksong_test/translation.log'
+            self.log_path = 'silksong_test/translation.log'
+        
+        if self._logger is not None and not self._custom_logger:
+            self._attach_log_handler()
+    
+    @property
+    def logger(self) -> logging.Logger:
+        """每个翻译器使用独立的子logger，同一进程中的多个翻译器不会互相覆盖日志"""
+        if self._logger is None:
+            self._logger = logging.getLogger('SilksongTranslator').getChild(str(id(self)))
+            self._logger.setLevel(logging.INFO)
+            self._attach_log_handler()
+        return self._logger
+    
+    @logger.setter
+    def logger(self, logger: logging.Logger):
+        """改用调用方提供的logger（如基准中的静默logger），不再为其附加日志文件"""
+        self._logger = logger
+        self._custom_logger = True
+    
+    def _attach_log_handler(self):
+        # 只移除并关闭本翻译器之前的处理器
+        for handler in list(self._logger.handlers):
+            self._logger.removeHandler(handler)
+            handler.close()
+        
+        # 创建silksong_test目录（如果不存在）
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
         
         # 创建文件处理器
-        file_handler = logging.FileHandler(log_path, encoding='utf-8')
+        file_handler = logging.FileHandler(self.log_path, encoding='utf-8')
         file_handler.setLevel(logging.INFO)
         
         # 创建格式器
@@ -76,7 +1088,7 @@ class SilksongTranslator:
         file_handler.setFormatter(formatter)
         
         # 添加处理器到logger
-        self.logger.addHandler(file_handler)
+        self._logger.addHandler(file_handler)
     
     def load_prompt_template(self):
         """加载翻译风格模板"""
@@ -94,336 +1106,1205 @@ class SilksongTranslator:
 2. 字数控制：与原文大体一致
 3. 可读性：确保玩家只能模糊地理解基本含义，不知所云
 """
+        self.system_prompt = self.build_system_prompt()
     
-    def build_translation_prompt(self, items: List[tuple]) -> str:
-        """构建翻译Prompt"""
-        prompt = f"""{self.base_prompt}
+    def build_system_prompt(self) -> str:
+        """构建固定不变的系统提示：角色、风格规则、输出格式与要求
 
-【待翻译内容】：
-"""
-        
+        每个批次的请求都以这段完全相同的字节开头，服务商的前缀缓存才能命中；
+        任何随批次变化的内容都不能放进来。prompt.md已写明输出格式时不再重复。
+        """
+        parts = ["你是《杀戮尖塔》「文盲古风小生语言」翻译师。请严格按照JSON格式输出翻译结果。",
+                 self.base_prompt]
+        if '"translations"' not in self.base_prompt:
+            parts.append(OUTPUT_FORMAT_PROMPT)
+        parts.append("用户消息中每行是一条待翻译内容，格式为「序号. key: 原文」。")
+        return '\n\n'.join(part.strip() for part in parts) + '\n'
+    
+    def build_translation_prompt(self, items: List[tuple]) -> str:
+        """构建每批次的用户消息：只含待翻译条目，放在固定前缀之后"""
+        lines = ["【待翻译内容】："]
         for i, (key, text) in enumerate(items, 1):
-            prompt += f"{i}. {key}: {text}\n"
-        
-        prompt += """
+            lines.append(f"{i}. {key}: {text}")
+        return '\n'.join(lines) + '\n'
 
-请按照以下JSON格式输出翻译结果：
-{
-  "translations": [
-    {"key": "原始key", "original": "原文", "translation": "丝之歌译文"},
-    ...
-  ]
-}
-
-要求：
-1. 严格按照JSON格式输出
-2. 保持key不变
-3. 译文字数与原文大体一致
-4. 保持游戏格式标记（如NL、!D!、[G]等）
-"""
-        
-        return prompt
+    async def call_openai_api(self, prompt: str, model: str = "deepseek-chat",
+                              on_entry: Callable[[Dict], None] = None, stats: Dict = None) -> Dict:
+        """调用OpenAI API进行翻译，支持重试机制
 
-    async def call_openai_api(self, prompt: str, model: str = "deepseek-chat") -> Dict:
-        """调用OpenAI API进行翻译，支持重试机制"""
+        每次请求先由路由器选出后端，再经过该后端的并发控制器；429/5xx会收缩其并发并遵循Retry-After，
+        重试时优先换一个后端，有其他后端可用时不做退避等待。
+        流式模式下每解析出一条译文即回调on_entry；流中途断开时返回已收到的条目，
+        剩余条目由调用方补请求。非流式模式下可开启对冲请求（见_hedged_send）。
+        stats不为None时填入排队耗时、请求延迟、token用量、重试次数与解析耗时；
+        stats['status']为 ok / partial / invalid（内容无法解析） / failed（重试用尽或不可重试的请求错误）。
+        """
         max_retries = 3
         base_delay = 1  # 基础延迟时间（秒）
+        if stats is None:
+            stats = {}
+        stats.update(queue_wait=0.0, retries=0, status='failed')
+        self.api_calls += 1
+        backend = None
         
         for attempt in range(max_retries + 1):
+            received = []
+            delay = 0
+            request = dict(
+                model=model,
+                messages=[
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                response_format={"type": "json_object"},
+                temperature=self.temperature,
+                max_tokens=self.max_tokens
+            )
             try:
-                response = await self.client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {
-                            "role": "system", 
-                            "content": "你是《杀戮尖塔》「文盲古风小生语言」翻译师。请严格按照JSON格式输出翻译结果。"
-                        },
-                        {"role": "user", "content": prompt}
-                    ],
-                    response_format={"type": "json_object"},
-                    temperature=1.2,
-                    max_tokens=12000
-                )
-                
-                result = json.loads(response.choices[0].message.content)
-                return result
+                # 后端在拿到并发名额时才选定，重试时优先避开上次失败的后端
+                if self.stream:
+                    return await self._send(request, stats, received, on_entry, exclude=backend)
+                if self.hedge_percentile:
+                    return await self._hedged_send(request, stats, exclude=backend)
+                return await self._send(request, stats, exclude=backend)
                 
             except Exception as e:
-                error_msg = str(e)
-                is_retryable = any(code in error_msg for code in ['502', '503', '504', '429', 'timeout', 'connection'])
+                if received:
+                    # 流已产出部分条目：保留它们，不整体重试
+                    print(f"流式响应中断，已收到 {len(received)} 条: {e}")
+                    stats['status'] = 'partial'
+                    return {"translations": received}
+                if isinstance(e, ValueError):
+                    # 请求成功但内容不是合法JSON（如输出被截断）：交给调用方拆分批次
+                    print(f"返回内容无法解析 [{getattr(e, 'backend', backend).name}]: {e}")
+                    stats['status'] = 'invalid'
+                    return {"translations": []}
                 
+                backend = getattr(e, 'backend', backend)
+                status, retry_after, is_retryable = classify_error(e)
                 if attempt < max_retries and is_retryable:
-                    delay = base_delay * (2 ** attempt)  # 指数退避
-                    print(f"API调用失败 (尝试 {attempt + 1}/{max_retries + 1}): {e}")
-                    print(f"等待 {delay} 秒后重试...")
-                    await asyncio.sleep(delay)
+                    self.api_retries += 1
+                    stats['retries'] += 1
+                    print(f"API调用失败 [{backend.name}] (尝试 {attempt + 1}/{max_retries + 1}): {e}")
+                    if self.router.available(exclude=backend):
+                        print("换一个后端重试...")
+                    else:
+                        delay = max(retry_after or 0, base_delay * (2 ** attempt))  # 指数退避
+                        print(f"等待 {delay:.1f} 秒后重试... (当前并发上限 {int(backend.limiter.limit)})")
                 else:
                     print(f"API调用最终失败: {e}")
                     return {"translations": []}
+            
+            # 退避等待期间不占用并发名额
+            if delay:
+                await asyncio.sleep(delay)
+        
+        return {"translations": []}
+    
+    async def _send(self, request: Dict, stats: Dict,
+                    received: List[Dict] = None, on_entry: Callable[[Dict], None] = None,
+                    exclude: Backend = None, started: asyncio.Future = None) -> Dict:
+        """经路由器拿到某个后端的并发名额后发出一次请求并解析结果
+
+        成功与失败都会反馈给并发控制器和路由器；失败时异常带上backend属性后原样抛出。
+        started在真正发出请求（拿到并发名额）时以选中的后端完成，供对冲计时使用。
+        """
+        wait_start = time.monotonic()
+        backend = await self.router.acquire(exclude)
+        request_start = time.monotonic()
+        stats['queue_wait'] = stats.get('queue_wait', 0.0) + request_start - wait_start
+        stats['backend'] = backend.name
+        self.api_requests += 1
+        if started is not None:
+            started.set_result(backend)
+        request = dict(request, model=backend.model or request['model'])
+        try:
+            if self.stream:
+                result = await self._read_stream(backend, request, received if received is not None else [],
+                                                 on_entry, stats, request_start)
+                stats['latency'] = time.monotonic() - request_start
+            else:
+                response = await backend.client.chat.completions.create(**request)
+                stats['latency'] = time.monotonic() - request_start
+                stats.update(read_usage(getattr(response, 'usage', None)))
+                backend.limiter.on_success()
+                
+                parse_start = time.monotonic()
+                result = json.loads(response.choices[0].message.content)
+                stats['parse_time'] = time.monotonic() - parse_start
+            
+            stats['status'] = 'ok'
+            self.router.report_success(backend, stats['latency'])
+            self.recent_latencies.append(stats['latency'])
+            return result
+        
+        except Exception as e:
+            status, retry_after, _ = classify_error(e)
+            if status in RETRYABLE_STATUS:
+                backend.limiter.on_throttle(retry_after)
+            self.router.report_failure(backend, status, retry_after)
+            e.backend = backend
+            raise
+        finally:
+            await self.router.release(backend)
+    
+    def hedge_delay(self) -> Optional[float]:
+        """对冲等待时间：近期成功请求延迟的hedge_percentile分位数；样本不足时不对冲"""
+        if len(self.recent_latencies) < self.hedge_min_samples:
+            return None
+        return percentile(list(self.recent_latencies), self.hedge_percentile)
+    
+    async def _hedged_send(self, request: Dict, stats: Dict, exclude: Backend = None) -> Dict:
+        """对冲请求：主请求超过近期延迟分位数仍未返回时，向另一后端（或同一后端）再发一份
+
+        先返回有效结果的一方胜出，另一方被取消；被取消请求的输入token计为浪费。
+        两份都失败时抛出后失败的那个异常。
+        """
+        primary_stats = {}
+        started = asyncio.get_running_loop().create_future()
+        primary = asyncio.ensure_future(self._send(request, primary_stats, exclude=exclude, started=started))
+        tasks = {primary: primary_stats}
+        
+        try:
+            # 计时从真正发出请求开始，排队等待并发名额的时间不算慢；
+            # 对冲阈值也在此时才取，排队期间其他批次积累的延迟样本都能用上
+            await asyncio.wait({primary, started}, return_when=asyncio.FIRST_COMPLETED)
+            delay = self.hedge_delay()
+            if delay is not None and not primary.done():
+                await asyncio.wait({primary}, timeout=delay)
+                if not primary.done():
+                    hedge_stats = {}
+                    self.hedges += 1
+                    stats['hedged'] = True
+                    print(f"请求超过 {delay:.1f} 秒未返回，发出对冲请求")
+                    hedge = self._send(request, hedge_stats, exclude=started.result())
+                    tasks[asyncio.ensure_future(hedge)] = hedge_stats
+            
+            error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    winner_stats = tasks[task]
+                    if task is not primary:
+                        self.hedge_wins += 1
+                        stats['hedge_won'] = True
+                    wasted = self._count_hedge_waste(tasks, request)
+                    stats.update(winner_stats)
+                    stats['queue_wait'] = sum(s.get('queue_wait', 0.0) for s in tasks.values())
+                    if wasted:
+                        stats['wasted_tokens'] = wasted
+                    return task.result()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    def _count_hedge_waste(self, tasks: Dict, request: Dict) -> int:
+        """统计即将被取消的请求浪费的token：已发出（拿到并发名额）的按估算输入token计"""
+        if len(tasks) < 2:
+            return 0
+        prompt_tokens = sum(estimate_tokens(m['content']) for m in request['messages'])
+        wasted = sum(prompt_tokens for task, task_stats in tasks.items()
+                     if not task.done() and 'backend' in task_stats)
+        self.hedge_wasted_tokens += wasted
+        return wasted
+    
+    def load_incremental_base(self, output_file: str, snapshot_file: str) -> Optional[Dict[str, tuple]]:
+        """加载增量翻译的基准
+
+        读取上次的输出与上次的原文快照，返回 {key: (旧原文, 旧译文)}；
+        任一文件不存在时返回None，表示需要全量翻译。
+        旧译文与旧原文相同的条目不作为基准：它们可能是上次翻译失败、保留了原文的条目
+        （快照总会保存，队列模式与低内存模式也一样），交给缓存判断；确实无需改写的条目会命中缓存。
+        """
+        if not (os.path.exists(output_file) and os.path.exists(snapshot_file)):
+            return None
+        
+        with open(snapshot_file, 'r', encoding='utf-8') as f:
+            old_items = []
+            self._extract_translation_items(json.load(f), old_items)
+        with open(output_file, 'r', encoding='utf-8') as f:
+            output_items = []
+            self._extract_translation_items(json.load(f), output_items)
+        
+        old_translations = dict(output_items)
+        return {key: (text, old_translations[key]) for key, text in old_items
+                if key in old_translations and old_translations[key] != text}
+    
+    async def _read_stream(self, backend: Backend, request: Dict, received: List[Dict],
+                           on_entry: Callable[[Dict], None] = None,
+                           stats: Dict = None, request_start: float = None) -> Dict:
+        """以流式方式请求并增量解析，received随解析进度追加"""
+        if stats is None:
+            stats = {}
+        parser = TranslationStreamParser()
+        stream = await backend.client.chat.completions.create(
+            stream=True, stream_options={"include_usage": True}, **request
+        )
+        first_chunk = True
+        parse_time = 0.0
+        async for chunk in stream:
+            if first_chunk:
+                # 收到首个分片即说明请求已被接受
+                backend.limiter.on_success()
+                if request_start is not None:
+                    stats['first_token'] = time.monotonic() - request_start
+                first_chunk = False
+            if getattr(chunk, 'usage', None) is not None:
+                stats.update(read_usage(chunk.usage))
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if not content:
+                continue
+            parse_start = time.monotonic()
+            entries = parser.feed(content)
+            parse_time += time.monotonic() - parse_start
+            stats['parse_time'] = parse_time
+            for entry in entries:
+                received.append(entry)
+                if on_entry is not None:
+                    on_entry(entry)
+        
+        if not parser.in_array:
+            # 模型没有按约定输出translations数组，按完整JSON兜底解析
+            return json.loads(parser.buffer)
+        return {"translations": received}
     
-    async def translate_file(self, file_path: str, model: str = "deepseek-chat") -> Dict:
-        """翻译单个JSON文件"""
+    def check_markers(self, key: str, source: str, translation: str) -> Optional[str]:
+        """校验并修复译文中的格式标记
+
+        - NL与能量图标前后的空格直接修复（与fix_keywords.py规则相同）
+        - 占位符（!D!、[E]、{0}、%s等）多重集合与原文不一致时返回None，由调用方重新请求
+        - 排版标记（NL、#y、@、~）不一致时只记警告，保留译文
+        """
+        repaired = fix_keywords_in_text(translation)
+        if repaired != translation:
+            self.marker_repairs += 1
+        
+        if Counter(PLACEHOLDER_PATTERN.findall(source)) != Counter(PLACEHOLDER_PATTERN.findall(repaired)):
+            self.marker_rejections += 1
+            self.logger.warning(f"占位符不一致，重新请求: [{key}] {source} -> {repaired}")
+            return None
+        if Counter(FORMAT_PATTERN.findall(source)) != Counter(FORMAT_PATTERN.findall(repaired)):
+            self.marker_warnings += 1
+            self.logger.warning(f"排版标记不一致: [{key}] {source} -> {repaired}")
+        return repaired
+    
+    def parse_translations(self, result: Dict, batch: List[tuple], checked: set = None) -> Dict[str, str]:
+        """从模型返回中取出本批次的合法译文 {key: 译文}
+
+        不在本批次中的key、缺失或非字符串的译文、占位符与原文不一致的译文都视为无效。
+        checked中的key已在流式解析时校验过，跳过，避免重复计数与重复警告。
+        """
+        sources = dict(batch)
+        entries = result.get('translations') if isinstance(result, dict) else None
+        if isinstance(entries, dict):
+            # 兼容模型直接返回 {key: 译文} 的写法
+            entries = [{'key': key, 'translation': value} for key, value in entries.items()]
+        if not isinstance(entries, list):
+            return {}
+        
+        translations = {}
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            key = entry.get('key')
+            translation = entry.get('translation')
+            if checked and key in checked:
+                continue
+            if key in sources and isinstance(translation, str) and translation.strip():
+                translation = self.check_markers(key, sources[key], translation)
+                if translation is not None:
+                    translations[key] = translation
+        return translations
+    
+    async def translate_batch(self, batch: List[tuple], model: str = "deepseek-chat",
+                              single_retries: int = 1,
+                              on_translations: Callable[[Dict[str, str]], None] = None) -> Dict[str, str]:
+        """翻译一个批次，返回 {key: 译文}
+
+        - 返回结果与发送的批次逐key核对，只重新请求缺失或格式错误的条目
+        - 整批没有任何有效结果时对半拆分递归请求，直到定位出问题条目
+        - 请求本身失败（重试用尽、鉴权错误等）时拆分无济于事，整批放弃
+        - 单条目仍失败则放弃并记入failed_keys，不影响其余条目
+        - 每得到一批有效译文即回调on_translations（流式模式下逐条回调）
+        """
+        streamed = {}
+        checked = set()
+        
+        def on_entry(entry: Dict):
+            parsed = self.parse_translations({'translations': [entry]}, batch)
+            key = entry.get('key') if isinstance(entry, dict) else None
+            if isinstance(key, str):
+                checked.add(key)
+            if parsed and on_translations is not None:
+                on_translations(parsed)
+            streamed.update(parsed)
+        
+        stats = {}
+        result = await self.call_openai_api(self.build_translation_prompt(batch), model, on_entry, stats)
+        # 流式模式下已逐条校验过的条目直接沿用其结果
+        translations = dict(streamed)
+        translations.update(self.parse_translations(result, batch, checked))
+        if self.metrics is not None:
+            file_name, batch_no = current_batch.get()
+            returned = result.get('translations') if isinstance(result, dict) else None
+            stats.update(time=time.time(), file=file_name, batch=batch_no, sent=len(batch),
+                         returned=len(returned) if isinstance(returned, (list, dict)) else 0,
+                         valid=len(translations))
+            self.metrics.record(stats)
+        unreported = {key: value for key, value in translations.items() if key not in streamed}
+        if unreported and on_translations is not None:
+            on_translations(unreported)
+        missing = [item for item in batch if item[0] not in translations]
+        if not missing:
+            return translations
+        
+        if stats.get('status') == 'failed':
+            # 接口不可用或请求被拒：再拆分只会成倍增加请求，整批保留原文
+            for key, text in missing:
+                self.failed_keys.append(key)
+            print(f"批次请求失败，{len(missing)} 条保留原文: {', '.join(key for key, _ in missing[:5])}"
+                  f"{' ...' if len(missing) > 5 else ''}")
+        elif translations:
+            # 部分成功：只补请求缺失的条目
+            self.rerequested_entries += len(missing)
+            translations.update(await self.translate_batch(missing, model, single_retries, on_translations))
+        elif len(batch) > 1:
+            # 整批失败：对半拆分，隔离出问题条目
+            self.rerequested_entries += len(batch)
+            middle = len(batch) // 2
+            halves = await asyncio.gather(
+                self.translate_batch(batch[:middle], model, single_retries, on_translations),
+                self.translate_batch(batch[middle:], model, single_retries, on_translations)
+            )
+            for half in halves:
+                translations.update(half)
+        elif single_retries > 0:
+            self.rerequested_entries += 1
+            translations.update(await self.translate_batch(batch, model, single_retries - 1, on_translations))
+        else:
+            key, text = batch[0]
+            self.failed_keys.append(key)
+            print(f"条目翻译失败，保留原文: [{key}] {text}")
+        return translations
+    
+    async def translate_file(self, file_path: str, model: str = "deepseek-chat",
+                             previous: Dict[str, tuple] = None,
+                             journal: Optional[TranslationJournal] = None) -> Dict:
+        """翻译单个JSON文件
+
+        Args:
+            previous: 增量基准（见load_incremental_base），原文未变的条目直接沿用旧译文
+            journal: 批次日志，续跑时跳过其中已完成的条目，并记录本次完成的批次
+        """
         print(f"\n处理文件: {file_path}")
         
         # 加载原始数据
         with open(file_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
         
-        # 提取待翻译文本
+        # 提取待翻译文本，同时记录每条所在位置
         translation_items = []
-        self._extract_translation_items(data, translation_items)
+        refs = {}
+        self._extract_translation_items(data, translation_items, refs=refs)
         
         print(f"待翻译条目数: {len(translation_items)}")
         
-        # 批量翻译
-        all_translations = {}
-        for i in range(0, len(translation_items), self.batch_size):
-            batch = translation_items[i:i + self.batch_size]
-            print(f"翻译批次 {i//self.batch_size + 1}: {len(batch)} 条目")
-            
-            # 构建prompt并调用API
-            prompt = self.build_translation_prompt(batch)
-            result = await self.call_openai_api(prompt, model)
+        all_translations = await self.translate_items(translation_items, model, os.path.basename(file_path),
+                                                      previous, journal)
+        
+        # 重建JSON结构
+        return self.rebuild_json_structure(data, all_translations, refs)
+    
+    async def translate_file_streaming(self, file_path: str, output_file: str, model: str = "deepseek-chat",
+                                       journal: Optional[TranslationJournal] = None,
+                                       window_size: int = 1000, max_windows: int = 8):
+        """低内存模式翻译单个JSON文件：逐项读取、按窗口翻译、按原顺序逐项写出
+
+        每window_size个顶层条目为一个窗口，同时最多max_windows个窗口在翻译，
+        最早的窗口完成后立即写出并释放，峰值内存与文件大小无关。
+        不支持增量基准（需要载入整份旧输出）；缓存与批次日志照常生效。
+        """
+        print(f"\n处理文件（低内存模式）: {file_path}")
+        file_name = os.path.basename(file_path)
+        writer = JsonObjectWriter(output_file)
+        pending = deque()  # 按文件顺序排列的窗口任务
+        total = 0
+        
+        async def translate_window(window: Dict) -> Dict:
+            nonlocal total
+            items, refs = [], {}
+            self._extract_translation_items(window, items, refs=refs)
+            total += len(items)
+            translations = await self.translate_items(items, model, file_name, None, journal,
+                                                      release_dedup=True)
+            return self.rebuild_json_structure(window, translations, refs)
+        
+        async def flush_oldest():
+            for key, value in (await pending.popleft()).items():
+                writer.write(key, value)
+        
+        try:
+            window = {}
+            for key, value in iter_json_object(file_path):
+                window[key] = value
+                if len(window) >= window_size:
+                    pending.append(asyncio.ensure_future(translate_window(window)))
+                    window = {}
+                    if len(pending) >= max_windows:
+                        await flush_oldest()
+            if window:
+                pending.append(asyncio.ensure_future(translate_window(window)))
+            while pending:
+                await flush_oldest()
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            writer.abort()
+            raise
+        writer.close()
+        print(f"待翻译条目数: {total}，共写出 {writer.count} 个顶层条目")
+    
+    @staticmethod
+    def dedup_key(model: str, text) -> tuple:
+        """跨文件去重的键：同一模型下原文相同即共享译文"""
+        return model, text if isinstance(text, str) else json.dumps(text, ensure_ascii=False)
+    
+    def resolve_known(self, translation_items: List[tuple], model: str,
+                      previous: Dict[str, tuple] = None, journal: Optional[TranslationJournal] = None,
+                      on_resolved: Callable[[str, str, str, str], None] = None) -> tuple:
+        """不用请求就能确定译文的条目，依次为：空白原文、增量基准、批次日志、缓存
+
+        翻译与plan命令共用这一流程。返回 (已确定的 {key: 译文}, 剩余条目, 各环节 {名称: (确定条数, 剩余条数)},
+        剩余条目的 {key: 缓存键})；on_resolved(key, 原文, 译文, 来源) 在非空白条目确定时回调。
+        """
+        # 空白原文无需翻译，直接保留
+        resolved = {key: text for key, text in translation_items if not text.strip()}
+        remaining = [item for item in translation_items if item[0] not in resolved]
+        counts = {'blank': (len(resolved), len(remaining))}
+        
+        def take(origin: str, found: Dict[str, str]):
+            nonlocal remaining
+            for key, text in remaining:
+                if key in found:
+                    resolved[key] = found[key]
+                    if on_resolved is not None:
+                        on_resolved(key, text, found[key], origin)
+            remaining = [item for item in remaining if item[0] not in found]
+            counts[origin] = (len(found), len(remaining))
+        
+        # 增量模式：原文未变的条目沿用上次的译文
+        if previous is not None:
+            take('incremental', {key: previous[key][1] for key, text in remaining
+                                 if key in previous and previous[key][0] == text})
+        
+        # 断点续跑：跳过日志中已完成且原文未变的条目
+        if journal is not None and journal.completed:
+            take('journal', {key: journal.completed[key][1] for key, text in remaining
+                             if key in journal.completed and journal.completed[key][0] == text})
+        
+        # 查缓存，命中的条目不再请求
+        cache_keys = {}
+        if self.cache is not None:
+            cache_keys = {key: TranslationCache.make_key(text, model, self.base_prompt, self.temperature)
+                          for key, text in remaining}
+            cached = self.cache.get_many(list(cache_keys.values()))
+            take('cache', {key: cached[cache_key] for key, cache_key in cache_keys.items() if cache_key in cached})
+        
+        return resolved, remaining, counts, cache_keys
+    
+    async def translate_items(self, translation_items: List[tuple], model: str, file_name: str,
+                              previous: Dict[str, tuple] = None,
+                              journal: Optional[TranslationJournal] = None,
+                              release_dedup: bool = False) -> Dict[str, str]:
+        """翻译一组 (key, 原文)，返回 {key: 译文}
+
+        依次经过：空白原文、增量基准、批次日志、缓存、去重，剩余条目打包成批并发请求。
+        release_dedup为True时，本组负责的去重记录在完成后移除，避免长时间运行时无限增长
+        （之后的相同原文改由缓存命中）。
+        """
+        model = self.served_model(model)
+        
+        def to_ledger(key: str, source: str, translation: str, origin: str, batch: int = None):
+            if self.ledger is not None:
+                self.ledger.record(file_name, key, source, translation, model, batch, origin)
+        
+        all_translations, translation_items, counts, cache_keys = self.resolve_known(
+            translation_items, model, previous, journal, to_ledger)
+        messages = {'incremental': "增量模式: 沿用 {} 条，新增/变更 {} 条",
+                    'journal': "断点续跑: 已完成 {} 条，剩余 {} 条",
+                    'cache': "缓存命中: {} 条，需请求: {} 条"}
+        for stage, (hits, left) in counts.items():
+            if stage in messages:
+                print(messages[stage].format(hits, left))
+        
+        # 去重：同一原文只请求一次。本文件首次出现的原文由本文件负责请求，
+        # 其他文件（或本文件更早的批次）已在请求的原文直接等待其结果
+        loop = asyncio.get_running_loop()
+        owned = {}    # 去重键 -> 本文件中共享该原文的key列表
+        waiting = {}  # 去重键 -> (其他文件负责的Future, 本文件中等待其结果的key列表)
+        dedup_keys = {}
+        request_items = []
+        for key, text in translation_items:
+            dedup_key = self.dedup_key(model, text)
+            dedup_keys[key] = dedup_key
+            if dedup_key in owned:
+                owned[dedup_key].append(key)
+            elif dedup_key in waiting:
+                waiting[dedup_key][1].append(key)
+            elif dedup_key in self._dedup_futures:
+                waiting[dedup_key] = (self._dedup_futures[dedup_key], [key])
+            else:
+                self._dedup_futures[dedup_key] = loop.create_future()
+                owned[dedup_key] = [key]
+                request_items.append((key, text))
+        saved = len(translation_items) - len(request_items)
+        self.dedup_saved += saved
+        if saved:
+            print(f"去重: {saved} 条重复原文共享译文，需请求: {len(request_items)} 条")
+        
+        # 并发批量翻译：所有批次同时排队，由并发控制器决定实际在途数量
+        batches = pack_batches(request_items, self.token_budget, self.output_budget)
+        
+        async def run_batch(batch_no: int, batch: List[tuple]):
+            current_batch.set((file_name, batch_no))
+            sources = dict(batch)
+            done = 0
             
-            # 处理结果
-            if 'translations' in result:
-                for trans in result['translations']:
-                    key = trans.get('key')
-                    translation = trans.get('translation')
-                    if key and translation:
-                        all_translations[key] = translation
+            def commit(fresh: Dict[str, str]):
+                """得到译文即回填、落日志、写缓存（流式模式下逐条调用）"""
+                nonlocal done
+                entries = []
+                for key, translation in fresh.items():
+                    # 译文回填到所有共享该原文的key
+                    dedup_key = dedup_keys[key]
+                    for shared_key in owned[dedup_key]:
+                        all_translations[shared_key] = translation
+                        entries.append((shared_key, sources[key], translation))
+                        to_ledger(shared_key, sources[key], translation, 'api', batch_no)
+                    future = self._dedup_futures[dedup_key]
+                    if not future.done():
+                        future.set_result(translation)
+                
+                if journal is not None:
+                    journal.record(batch_no, entries)
+                if self.cache is not None:
+                    self.cache.put_many([(cache_keys[key], model, sources[key], translation)
+                                         for key, translation in fresh.items()])
+                
+                previous_done = done
+                done += len(fresh)
+                if self.stream and done // 20 > previous_done // 20:
+                    print(f"翻译批次 {batch_no}/{len(batches)} 进度: {done}/{len(batch)} 条目")
             
-            # 简单延迟避免频率限制
-            if i + self.batch_size < len(translation_items):
-                await asyncio.sleep(1)
+            await self.translate_batch(batch, model, on_translations=commit)
+            print(f"翻译批次 {batch_no}/{len(batches)} 完成: {done}/{len(batch)} 条目")
         
-        # 重建JSON结构
-        return self.rebuild_json_structure(data, all_translations)
+        try:
+            await asyncio.gather(*(run_batch(no, batch) for no, batch in enumerate(batches, 1)))
+        finally:
+            # 未译成的原文也要结束等待，避免其他文件永久挂起
+            for dedup_key in owned:
+                future = self._dedup_futures[dedup_key]
+                if not future.done():
+                    future.set_result(None)
+                if release_dedup:
+                    del self._dedup_futures[dedup_key]
+        
+        for dedup_key, (future, keys) in waiting.items():
+            translation = await future
+            if translation is not None:
+                for key in keys:
+                    all_translations[key] = translation
+                    to_ledger(key, dedup_key[1], translation, 'dedup')
+        
+        return all_translations
     
-    def _extract_translation_items(self, data, translation_items, prefix=""):
-        """递归提取待翻译文本"""
+    @staticmethod
+    def _extract_translation_items(data, translation_items, prefix="", refs: Dict = None):
+        """递归提取待翻译文本
+
+        refs不为None时，同时记录每个key所在的容器与下标 {key: (容器, 字段名或索引)}，
+        rebuild_json_structure据此一步写回，不再依赖拆分key字符串。
+        """
+        def add(key, container, field):
+            translation_items.append((key, container[field]))
+            if refs is not None:
+                refs[key] = (container, field)
+        
+        def add_list(key_prefix, values):
+            for i, text in enumerate(values):
+                if isinstance(text, str):
+                    add(f"{key_prefix}_{i}", values, i)
+        
         if isinstance(data, dict):
             for key, item_data in data.items():
                 current_prefix = f"{prefix}_{key}" if prefix else key
                 
                 if isinstance(item_data, dict):
                     # 处理NAME字段
-                    if 'NAME' in item_data:
-                        translation_items.append((f"{current_prefix}_NAME", item_data['NAME']))
-                    elif 'NAMES' in item_data and item_data['NAMES']:
+                    if isinstance(item_data.get('NAME'), str):
+                        add(f"{current_prefix}_NAME", item_data, 'NAME')
+                    elif isinstance(item_data.get('NAMES'), list):
                         # 如果NAMES是列表，把列表里的每一项都提取
-                        for idx, name in enumerate(item_data['NAMES']):
-                            if isinstance(name, str):
-                                translation_items.append((f"{current_prefix}_NAME_{idx}", name))
+                        add_list(f"{current_prefix}_NAME", item_data['NAMES'])
                     
-                    # 处理DESCRIPTION字段
-                    if 'DESCRIPTION' in item_data:
-                        translation_items.append((f"{current_prefix}_DESC", item_data['DESCRIPTION']))
-                    elif 'UPGRADE_DESCRIPTION' in item_data:
-                        translation_items.append((f"{current_prefix}_UPGRADE_DESC", item_data['UPGRADE_DESCRIPTION']))
+                    # 处理DESCRIPTION字段（字符串或列表）
+                    if isinstance(item_data.get('DESCRIPTION'), str):
+                        add(f"{current_prefix}_DESC", item_data, 'DESCRIPTION')
+                    elif isinstance(item_data.get('DESCRIPTION'), list):
+                        add_list(f"{current_prefix}_DESC", item_data['DESCRIPTION'])
+                    if isinstance(item_data.get('UPGRADE_DESCRIPTION'), str):
+                        add(f"{current_prefix}_UPGRADE_DESC", item_data, 'UPGRADE_DESCRIPTION')
                         
                     # 处理TEXT字段（UI文本）
-                    if 'TEXT' in item_data:
-                        if isinstance(item_data['TEXT'], list):
-                            for i, text in enumerate(item_data['TEXT']):
-                                translation_items.append((f"{current_prefix}_TEXT_{i}", text))
-                        elif isinstance(item_data['TEXT'], str):
-                            translation_items.append((f"{current_prefix}_TEXT", item_data['TEXT']))
+                    if isinstance(item_data.get('TEXT'), list):
+                        add_list(f"{current_prefix}_TEXT", item_data['TEXT'])
+                    elif isinstance(item_data.get('TEXT'), str):
+                        add(f"{current_prefix}_TEXT", item_data, 'TEXT')
                     
                     # 处理其他可能包含文本的字段（如UNIQUE_REWARDS, OPTIONS等）
                     for field_name, field_value in item_data.items():
                         if field_name not in ['NAME', 'NAMES', 'DESCRIPTION', 'UPGRADE_DESCRIPTION', 'TEXT']:
                             if isinstance(field_value, list):
-                                for i, text in enumerate(field_value):
-                                    if isinstance(text, str):
-                                        translation_items.append((f"{current_prefix}_{field_name}_{i}", text))
+                                add_list(f"{current_prefix}_{field_name}", field_value)
                             elif isinstance(field_value, str):
-                                translation_items.append((f"{current_prefix}_{field_name}", field_value))
+                                add(f"{current_prefix}_{field_name}", item_data, field_name)
                             elif isinstance(field_value, dict):
                                 # 递归处理嵌套字典
-                                self._extract_translation_items(field_value, translation_items, f"{current_prefix}_{field_name}")
+                                SilksongTranslator._extract_translation_items(field_value, translation_items,
+                                                                              f"{current_prefix}_{field_name}", refs)
                 elif isinstance(item_data, list):
                     # 处理直接的列表字段（如keywords.json中的TEXT字段）
                     for i, text in enumerate(item_data):
                         if isinstance(text, str):
-                            translation_items.append((f"{current_prefix}_{i}", text))
+                            add(f"{current_prefix}_{i}", item_data, i)
                         elif isinstance(text, dict):
                             # 如果列表中包含字典，递归处理
-                            self._extract_translation_items(text, translation_items, f"{current_prefix}_{i}")
+                            SilksongTranslator._extract_translation_items(text, translation_items,
+                                                                          f"{current_prefix}_{i}", refs)
                 elif isinstance(item_data, str):
                     # 处理直接的字符串字段
-                    translation_items.append((current_prefix, item_data))
-                else:
-                    # 如果item_data本身不包含翻译字段，但是一个字典容器，继续递归
-                    if isinstance(item_data, dict):
-                        self._extract_translation_items(item_data, translation_items, current_prefix)
+                    add(current_prefix, data, key)
     
-    def rebuild_json_structure(self, original_data: Dict, translations: Dict[str, str]) -> Dict:
+    def rebuild_json_structure(self, original_data: Dict, translations: Dict[str, str],
+                               refs: Dict = None) -> Dict:
         """重建JSON结构，将翻译结果合并回原始格式
-        - 支持多层嵌套（prefix用下划线连接）
-        - 正确处理以下键格式：
-          * <path>_NAME
-          * <path>_DESC
-          * <path>_UPGRADE_DESC
-          * <path>_TEXT           (TEXT为字符串)
-          * <path>_TEXT_<idx>     (TEXT为列表)
-          * <path>_<FIELD>        (任意单字段字符串)
-          * <path>_<FIELD>_<idx>  (任意列表字段)
-        - 如果字段本身是列表，则把列表里的每一项都翻译
-        """
-        result_data = json.loads(json.dumps(original_data))  # 深拷贝
-
-        def get_nested_container(root: Dict, path_parts: List[str]):
-            """根据路径片段进入嵌套字典，返回目标容器(dict)。若路径不存在则返回None"""
-            node = root
-            for part in path_parts:
-                if isinstance(node, dict) and part in node:
-                    node = node[part]
-                else:
-                    return None
-            return node
 
+        - 一次遍历复制容器（字符串不可变，直接共享），同时建立 原容器 -> 新容器 的映射
+        - 每条译文按提取时记录的 (容器, 字段名或索引) 直接写入新容器，O(1)
+        - key中含下划线的ID也能正确定位
+
+        Args:
+            refs: _extract_translation_items记录的位置表；为None时重新提取
+        """
+        if refs is None:
+            refs = {}
+            self._extract_translation_items(original_data, [], refs=refs)
+        
+        copies = {}
+        result_data = copy_json_tree(original_data, copies)
+        
         for key, translation in translations.items():
-            parts = key.split('_')
-            if len(parts) < 2:
+            location = refs.get(key)
+            if location is None:
                 continue
+            container, field = location
+            copies[id(container)][field] = translation
+        
+        return result_data
 
-            original_text = None
 
-            # 情况一：末尾是固定字段名（无索引）
-            if parts[-1] in ("NAME", "DESC", "UPGRADE_DESC", "TEXT"):
-                field_tag = parts[-1]
-                container_path = parts[:-1]
-                container = get_nested_container(result_data, container_path)
-                if not isinstance(container, dict):
-                    continue
+def extract_items(data) -> tuple:
+    """提取 (key, 原文) 列表与位置表；不需要创建翻译器，没有API密钥时也可用"""
+    items, refs = [], {}
+    SilksongTranslator._extract_translation_items(data, items, refs=refs)
+    return items, refs
 
-                if field_tag == 'NAME':
-                    if 'NAME' in container and isinstance(container['NAME'], str):
-                        original_text = container['NAME']
-                        container['NAME'] = translation
-                    elif 'NAMES' in container and isinstance(container['NAMES'], list):
-                        # 如果NAMES是列表，把列表里的每一项都翻译
-                        for idx, item in enumerate(container['NAMES']):
-                            if isinstance(item, str):
-                                original_text = item
-                                container['NAMES'][idx] = translation
-                                self.logger.info(f"翻译: [{key}_{idx}] {original_text} -> {translation}")
-                        continue  # 已经记录日志，跳过下面的统一记录
-                elif field_tag == 'DESC':
-                    if 'DESCRIPTION' in container and isinstance(container['DESCRIPTION'], str):
-                        original_text = container['DESCRIPTION']
-                        container['DESCRIPTION'] = translation
-                elif field_tag == 'UPGRADE_DESC':
-                    if 'UPGRADE_DESCRIPTION' in container and isinstance(container['UPGRADE_DESCRIPTION'], str):
-                        original_text = container['UPGRADE_DESCRIPTION']
-                        container['UPGRADE_DESCRIPTION'] = translation
-                elif field_tag == 'TEXT':
-                    if 'TEXT' in container and isinstance(container['TEXT'], str):
-                        original_text = container['TEXT']
-                        container['TEXT'] = translation
-                    elif 'TEXT' in container and isinstance(container['TEXT'], list):
-                        # 如果TEXT是列表，把列表里的每一项都翻译
-                        for idx, item in enumerate(container['TEXT']):
-                            if isinstance(item, str):
-                                original_text = item
-                                container['TEXT'][idx] = translation
-                                self.logger.info(f"翻译: [{key}_{idx}] {original_text} -> {translation}")
-                        continue  # 已经记录日志，跳过下面的统一记录
-
-            # 情况二：末尾是索引（列表项），如 _TEXT_3 或 _OPTIONS_1
-            elif parts[-1].isdigit():
-                idx = int(parts[-1])
-                
-                if len(parts) >= 3:
-                    # 标准情况：container_field_idx
-                    field_name = parts[-2]
-                    container_path = parts[:-2]
-                    container = get_nested_container(result_data, container_path)
-                    if not isinstance(container, dict):
-                        continue
 
-                    # NAME列表（NAMES字段）
-                    if field_name == 'NAME':
-                        if 'NAMES' in container and isinstance(container['NAMES'], list) and 0 <= idx < len(container['NAMES']):
-                            if isinstance(container['NAMES'][idx], str):
-                                original_text = container['NAMES'][idx]
-                                container['NAMES'][idx] = translation
-                    # TEXT列表
-                    elif field_name == 'TEXT':
-                        if 'TEXT' in container and isinstance(container['TEXT'], list) and 0 <= idx < len(container['TEXT']):
-                            original_text = container['TEXT'][idx]
-                            container['TEXT'][idx] = translation
-                    else:
-                        # 其他列表字段（如 OPTIONS、UNIQUE_REWARDS 等）
-                        if field_name in container and isinstance(container[field_name], list) and 0 <= idx < len(container[field_name]):
-                            if isinstance(container[field_name][idx], str):
-                                original_text = container[field_name][idx]
-                                container[field_name][idx] = translation
-                elif len(parts) == 2:
-                    # 直接列表字段情况：field_idx（如 TEXT_0）
-                    field_name = parts[0]
-                    container = result_data
-                    if field_name in container and isinstance(container[field_name], list) and 0 <= idx < len(container[field_name]):
-                        if isinstance(container[field_name][idx], str):
-                            original_text = container[field_name][idx]
-                            container[field_name][idx] = translation
-
-            # 情况三：任意单字段字符串，如 _FOOTER 之类
-            else:
-                if len(parts) == 1:
-                    # 直接字符串字段情况（如单独的字符串字段）
-                    field_name = parts[0]
-                    container = result_data
-                    if field_name in container and isinstance(container[field_name], str):
-                        original_text = container[field_name]
-                        container[field_name] = translation
-                else:
-                    # 嵌套字段情况
-                    field_name = parts[-1]
-                    container_path = parts[:-1]
-                    container = get_nested_container(result_data, container_path)
-                    if not isinstance(container, dict):
-                        continue
-                    if field_name in container and isinstance(container[field_name], str):
-                        original_text = container[field_name]
-                        container[field_name] = translation
+# 超过此大小的输入文件自动使用低内存模式
+LOW_MEMORY_THRESHOLD = 64 * 1024 * 1024
 
-            # 记录日志（列表翻译已在循环内记录，这里只记录单个字符串的翻译）
-            if original_text is not None:
-                self.logger.info(f"翻译: [{key}] {original_text} -> {translation}")
 
-        return result_data
+def list_json_files(directory: str) -> List[str]:
+    """目录下的本地化JSON文件，大文件优先：其批次最先排队，总耗时尽量接近最大文件的关键路径"""
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.json')]
+    return sorted(paths, key=os.path.getsize, reverse=True)
 
 
-# 简单的使用示例
-async def translate_single_file(input_file: str, output_file: str = None, model: str = "deepseek-chat"):
-    """翻译单个文件的简单接口"""
-    translator = SilksongTranslator()
-    # 重新配置日志系统以使用基于文件名的日志文件
-    translator.setup_logging(input_file)
+def file_pairs(input_path: str, output_path: str = None) -> List[tuple]:
+    """把文件或目录参数展开成 [(输入文件, 输出文件)]；未指定输出时写到silksong/下同名文件"""
+    if os.path.isdir(input_path):
+        output_dir = output_path or "silksong"
+        return [(path, os.path.join(output_dir, os.path.basename(path))) for path in list_json_files(input_path)]
+    return [(input_path, output_path or "silksong/" + os.path.basename(input_path))]
+
+
+def snapshot_path(output_file: str) -> str:
+    """输出文件对应的原文快照路径（供增量模式对比）"""
+    return os.path.join('silksong_test', 'snapshots', os.path.basename(output_file))
+
+
+def journal_path(output_file: str) -> str:
+    """输出文件对应的批次日志路径（供断点续跑）"""
+    name = os.path.splitext(os.path.basename(output_file))[0]
+    return os.path.join('silksong_test', 'journal', name + '.jsonl')
+
+
+def save_json(result: Dict, output_file: str):
+    """以游戏本地化文件的格式写出JSON；先写临时文件再替换，中途失败不会留下半截输出"""
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with AtomicFile(output_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+# 可能出现在JSON数字中的字符
+NUMBER_CHARS = '0123456789.eE+-'
+
+
+def iter_json_object(file_path: str, chunk_size: int = 1 << 16):
+    """流式读取顶层为对象的JSON文件，逐个产出 (key, value)
+
+    内存中只保留当前这一项的文本与解析结果，与文件总大小无关。
+    某一项跨越多个读取块时逐步加大读取量，避免对超大单项反复重解析。
+    """
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r'\s*')
     
-    result = await translator.translate_file(input_file, model)
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        pos = 0
+        eof = False
+        
+        def fill(size: int) -> bool:
+            """丢弃已解析部分并追加读取，文件已读完时返回False"""
+            nonlocal buffer, pos, eof
+            if eof:
+                return False
+            chunk = f.read(size)
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            eof = not chunk
+            return not eof
+        
+        def skip_whitespace():
+            nonlocal pos
+            while True:
+                pos = whitespace.match(buffer, pos).end()
+                if pos < len(buffer) or not fill(chunk_size):
+                    return
+        
+        def expect(chars: str) -> str:
+            skip_whitespace()
+            if pos >= len(buffer) or buffer[pos] not in chars:
+                found = buffer[pos:pos + 20] if pos < len(buffer) else '文件结尾'
+                raise ValueError(f"{file_path}: 期望 {chars!r}，实际为 {found!r}")
+            return buffer[pos]
+        
+        def decode():
+            nonlocal pos
+            skip_whitespace()
+            size = chunk_size
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    # 数字可能恰好被读取块截断（如1.5只读到"1."时会解析出1），
+                    # 后面紧跟分隔符才算完整，否则读入更多再解析
+                    truncated = end == len(buffer) or (
+                        buffer[end] in NUMBER_CHARS and isinstance(value, (int, float)))
+                    if eof or not truncated:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill(size)
+                size *= 2
+        
+        fill(chunk_size)
+        if buffer.startswith('\ufeff'):
+            pos = 1
+        expect('{')
+        pos += 1
+        if expect('}"') == '}':
+            return
+        while True:
+            key = decode()
+            expect(':')
+            pos += 1
+            yield key, decode()
+            if expect(',}') == '}':
+                return
+            pos += 1
+
+
+class JsonObjectWriter:
+    """逐项写出顶层JSON对象，输出与save_json（json.dump indent=2）逐字节一致
+
+    先写入同目录下的临时文件，close时再替换目标文件，中途失败不会留下半截输出。
+    """
+
+    def __init__(self, output_file: str):
+        output_dir = os.path.dirname(output_file)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self.output_file = output_file
+        self.target = AtomicFile(output_file, 'w', encoding='utf-8')
+        self.file = self.target.file
+        self.count = 0
+    
+    def write(self, key: str, value):
+        # 单项对象序列化后去掉首尾的花括号行，即为该项在完整输出中的文本
+        text = json.dumps({key: value}, ensure_ascii=False, indent=2)
+        self.file.write(('{\n' if self.count == 0 else ',\n') + text[2:-2])
+        self.count += 1
+    
+    def close(self):
+        self.file.write('\n}' if self.count else '{}')
+        self.target.commit()
+    
+    def abort(self):
+        self.target.discard()
+
+
+# 简单的使用示例
+async def translate_single_file(input_file: str, output_file: str = None, model: str = "deepseek-chat",
+                                translator: SilksongTranslator = None, incremental: bool = False,
+                                resume: bool = False, low_memory: bool = False):
+    """翻译单个文件的简单接口
+
+    每次翻译完成后保存原文快照；incremental为True时只翻译相对快照新增或变更的条目，
+    并与已有输出合并。翻译过程中每完成一批都写入批次日志，resume为True时从日志续跑。
+    low_memory为True或文件超过LOW_MEMORY_THRESHOLD时改用流式读写（见translate_file_streaming）。
+    """
+    if translator is None:
+        translator = SilksongTranslator()
+        # 重新配置日志系统以使用基于文件名的日志文件
+        translator.setup_logging(input_file)
     
     if output_file is None:
         output_file = "silksong/" + os.path.basename(input_file)
+    snapshot_file = snapshot_path(output_file)
     
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
+    if not low_memory and os.path.getsize(input_file) > LOW_MEMORY_THRESHOLD:
+        print(f"{os.path.basename(input_file)} 超过 {LOW_MEMORY_THRESHOLD // (1024 * 1024)} MB，使用低内存模式")
+        low_memory = True
+    if low_memory and incremental:
+        print("低内存模式不支持增量，将全量翻译（缓存仍然生效）")
+        incremental = False
+    
+    previous = None
+    if incremental:
+        previous = translator.load_incremental_base(output_file, snapshot_file)
+        if previous is None:
+            print(f"未找到上次的输出或原文快照，{os.path.basename(input_file)} 将全量翻译")
+    
+    journal = TranslationJournal(journal_path(output_file), resume=resume)
+    try:
+        if low_memory:
+            await translator.translate_file_streaming(input_file, output_file, model, journal)
+        else:
+            result = await translator.translate_file(input_file, model, previous, journal)
+            save_json(result, output_file)
+    except BaseException:
+        # 保留日志供 --resume 使用
+        journal.close()
+        raise
+    journal.close(remove=True)
+
+    os.makedirs(os.path.dirname(snapshot_file), exist_ok=True)
+    shutil.copyfile(input_file, snapshot_file)
     
     print(f"翻译完成，保存到: {output_file}")
 
 
-if __name__ == '__main__':
+async def translate_directory(input_dir: str, output_dir: str = None, model: str = "deepseek-chat",
+                              translator: SilksongTranslator = None, incremental: bool = False,
+                              resume: bool = False, low_memory: bool = False):
+    """整目录翻译：一次处理目录下所有本地化JSON
+
+    所有文件共用一个翻译器（同一客户端、同一并发预算），
+    按文件大小从大到小排队，使总耗时尽量接近最大文件的关键路径。
+    """
+    if translator is None:
+        translator = SilksongTranslator()
+    if output_dir is None:
+        output_dir = "silksong"
+    
+    input_files = list_json_files(input_dir)
+    if not input_files:
+        print(f"未找到JSON文件: {input_dir}")
+        return
+    
+    print(f"找到 {len(input_files)} 个JSON文件，输出目录: {output_dir}")
+    
+    start = time.monotonic()
+    results = await asyncio.gather(
+        *(translate_single_file(path, os.path.join(output_dir, os.path.basename(path)), model, translator,
+                                incremental, resume, low_memory)
+          for path in input_files),
+        return_exceptions=True
+    )
+    
+    failed = [(path, err) for path, err in zip(input_files, results) if isinstance(err, Exception)]
+    for path, err in failed:
+        print(f"✗ 处理失败 {os.path.basename(path)}: {err}")
+    print(f"\n全部完成: {len(input_files) - len(failed)}/{len(input_files)} 个文件成功，"
+          f"耗时 {time.monotonic() - start:.1f} 秒，去重节省 {translator.dedup_saved} 条请求")
+    print(f"补请求 {translator.rerequested_entries} 条，最终失败 {len(translator.failed_keys)} 条；"
+          f"格式标记修复 {translator.marker_repairs} 条，占位符不符重请求 {translator.marker_rejections} 条，"
+          f"排版标记警告 {translator.marker_warnings} 条")
+
+
+def add_translator_arguments(parser):
+    """翻译器相关的命令行参数（翻译、队列worker等命令共用）"""
+    parser.add_argument('--concurrency', type=int, default=4, help="初始并发批次数（默认4）")
+    parser.add_argument('--max-concurrency', type=int, default=32, help="并发批次数上限（默认32）")
+    parser.add_argument('--hedge', type=float, default=0, metavar='PERCENTILE',
+                        help="对冲请求：批次超过近期延迟的该分位数（如95）仍未返回时再发一份，先到者胜（默认关闭，仅非流式）")
+    parser.add_argument('--backends', help="多后端配置JSON文件，按延迟与错误率在多个接口/密钥间分配请求")
+    parser.add_argument('--stream', action='store_true', help="使用流式输出，每条译文生成即写入日志与缓存")
+    parser.add_argument('--metrics-dir', default='silksong_test',
+                        help="批次指标输出目录（metrics.jsonl与metrics.prom，默认silksong_test）")
+    parser.add_argument('--no-metrics', action='store_true', help="不记录批次指标")
+    parser.add_argument('--ledger-dir', default='silksong_test/ledger',
+                        help="译文台账目录，每个输入文件一份JSONL（默认silksong_test/ledger）")
+    parser.add_argument('--no-ledger', action='store_true', help="不记录译文台账")
+    parser.add_argument('--token-budget', type=int, default=4000, help="每批待翻译内容的输入token预算（默认4000）")
+    parser.add_argument('--cache', default='silksong_test/translation_cache.sqlite', help="翻译缓存文件路径")
+    parser.add_argument('--cache-max-mb', type=float, default=256, help="翻译缓存容量上限（MB，默认256）")
+    parser.add_argument('--no-cache', action='store_true', help="不使用翻译缓存")
+
+
+def create_translator(args) -> SilksongTranslator:
+    """按命令行参数创建翻译器及其缓存、指标与台账"""
+    cache = None
+    if not args.no_cache:
+        cache = TranslationCache(args.cache, max_bytes=int(args.cache_max_mb * 1024 * 1024))
+    
+    metrics = None
+    if not args.no_metrics:
+        metrics = MetricsRecorder(os.path.join(args.metrics_dir, 'metrics.jsonl'),
+                                  os.path.join(args.metrics_dir, 'metrics.prom'))
+    
+    ledger = None if args.no_ledger else TranslationLedger(args.ledger_dir)
+    
+    backends = load_backends(args.backends) if args.backends else None
+    return SilksongTranslator(concurrency=args.concurrency, max_concurrency=args.max_concurrency,
+                              cache=cache, token_budget=args.token_budget, stream=args.stream,
+                              metrics=metrics, backends=backends, hedge_percentile=args.hedge,
+                              ledger=ledger)
+
+
+def close_translator(translator: SilksongTranslator):
+    """打印本次运行的各项统计，并关闭台账、指标与缓存"""
+    if translator.backends and len(translator.backends) > 1:
+        print("\n后端统计:")
+        for row in translator.router.summary():
+            latency = f"{row['latency']:.2f}s" if row['latency'] is not None else "-"
+            print(f"  {row['name']}: 请求 {row['requests']}，失败 {row['failures']}，"
+                  f"平均延迟 {latency}，并发上限 {int(row['limit'])}")
+    if translator.hedges:
+        print(f"\n对冲请求 {translator.hedges} 次（对冲率 {translator.hedges / translator.api_calls:.1%}），"
+              f"对冲先返回 {translator.hedge_wins} 次，浪费输入token约 {translator.hedge_wasted_tokens}")
+    ledger = translator.ledger
+    if ledger is not None:
+        ledger.close()
+        if ledger.records:
+            print(f"译文台账: {ledger.records} 条，保存在 {ledger.directory}")
+    metrics = translator.metrics
+    if metrics is not None:
+        metrics.print_summary()
+        metrics.close()
+    cache = translator.cache
+    if cache is not None:
+        stats = cache.stats()
+        print(f"缓存统计: 命中 {stats['hits']}，未命中 {stats['misses']}（命中率 {stats['hit_rate']:.1%}），"
+              f"写入 {stats['writes']}，淘汰 {stats['evictions']}，"
+              f"共 {stats['entries']} 条 / {stats['bytes'] / 1024 / 1024:.1f} MB")
+        cache.close()
+
+
+# 前缀缓存按64 token为单位命中（DeepSeek、OpenAI均如此）
+PREFIX_CACHE_UNIT = 64
+
+
+def plan_file(translator: SilksongTranslator, input_file: str, output_file: str, model: str,
+              incremental: bool = False, seen: set = None) -> Dict:
+    """离线估算一个文件需要发送的请求，按translate_file的顺序扣除空白、增量沿用、缓存命中与跨文件去重
+
+    seen为各文件共用的去重集合；返回各环节的条目数与每个请求的 (输入token, 输出token)。
+    """
+    with open(input_file, 'r', encoding='utf-8') as f:
+        items, _ = extract_items(json.load(f))
+    row = {'file': os.path.basename(input_file), 'entries': len(items)}
+
+    model = translator.served_model(model)
+    previous = None
+    if incremental:
+        previous = translator.load_incremental_base(output_file, snapshot_path(output_file))
+    _, remaining, counts, _ = translator.resolve_known(items, model, previous)
+    row['blank'] = counts['blank'][0]
+    row['reused'] = counts.get('incremental', (0,))[0]
+    row['cached'] = counts.get('cache', (0,))[0]
+
+    if seen is None:
+        seen = set()
+    request_items = []
+    for key, text in remaining:
+        dedup_key = translator.dedup_key(model, text)
+        if dedup_key not in seen:
+            seen.add(dedup_key)
+            request_items.append((key, text))
+    row['deduped'] = len(remaining) - len(request_items)
+    row['to_request'] = len(request_items)
+
+    system_tokens = estimate_tokens(translator.system_prompt)
+    row['requests'] = [
+        (system_tokens + estimate_tokens(translator.build_translation_prompt(batch)),
+         sum(estimate_item_tokens(key, text)[1] for key, text in batch))
+        for batch in pack_batches(request_items, translator.token_budget, translator.output_budget)
+    ]
+    return row
+
+
+def estimate_wall_time(requests: List[tuple], concurrency: int, latency: float, output_tps: float) -> float:
+    """按给定并发把请求依次分配到最早空闲的槽位，估算总耗时
+
+    单个请求耗时按 固定延迟 + 输出token / 输出速度 估算，与translate_directory一样按提交顺序排队。
+    """
+    import heapq
+
+    slots = [0.0] * max(1, concurrency)
+    for _, output_tokens in requests:
+        start = heapq.heappop(slots)
+        heapq.heappush(slots, start + latency + output_tokens / output_tps)
+    return max(slots) if requests else 0.0
+
+
+def plan_main(argv: List[str]):
+    """plan 子命令：不联网、不需要API密钥，估算一次翻译的请求数、token、费用与耗时
+
+    只读打开缓存，不创建 silksong_test/ 与日志文件。
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='trans.py plan',
+                                     description="离线估算翻译的请求数、token用量、费用与耗时（不发送请求）")
+    parser.add_argument('input', help="输入文件；若为目录则估算目录下所有JSON文件")
+    parser.add_argument('output', nargs='?', default=None, help="输出文件或目录（--incremental时用于读取上次结果）")
+    parser.add_argument('model', nargs='?', default="deepseek-v3.1", help="模型名称（缓存按模型区分）")
+    parser.add_argument('--token-budget', type=int, default=4000, help="每批待翻译内容的输入token预算（默认4000）")
+    parser.add_argument('--concurrency', type=int, default=4, help="按此并发估算耗时（默认4）")
+    parser.add_argument('--cache', default='silksong_test/translation_cache.sqlite', help="翻译缓存文件路径（只读）")
+    parser.add_argument('--no-cache', action='store_true', help="不计入缓存命中")
+    parser.add_argument('--incremental', action='store_true', help="按增量模式估算：原文相对快照未变的条目不计")
+    parser.add_argument('--price-input', type=float, default=4.0, help="输入token单价（元/百万token，默认4）")
+    parser.add_argument('--price-cached', type=float, default=0.5,
+                        help="命中前缀缓存的输入token单价（元/百万token，默认0.5）")
+    parser.add_argument('--price-output', type=float, default=12.0, help="输出token单价（元/百万token，默认12）")
+    parser.add_argument('--latency', type=float, default=2.0, help="单个请求的固定延迟（秒，默认2）")
+    parser.add_argument('--output-tps', type=float, default=40.0, help="每个请求的输出速度（token/秒，默认40）")
+    args = parser.parse_args(argv)
+
+    cache = None
+    if not args.no_cache and os.path.exists(args.cache):
+        cache = TranslationCache(args.cache, readonly=True)
+    translator = SilksongTranslator(cache=cache, token_budget=args.token_budget)
+
+    seen = set()
+    try:
+        rows = [plan_file(translator, path, output, args.model, args.incremental, seen)
+                for path, output in file_pairs(args.input, args.output)]
+    finally:
+        if cache is not None:
+            cache.close()
+
+    print(f"{'文件':<24}{'条目':>8}{'空白':>7}{'沿用':>7}{'缓存':>7}{'去重':>7}{'待译':>8}{'请求':>6}"
+          f"{'输入token':>11}{'输出token':>11}")
+    for row in rows:
+        print(f"{row['file']:<24}{row['entries']:>8}{row['blank']:>7}{row['reused']:>7}{row['cached']:>7}"
+              f"{row['deduped']:>7}{row['to_request']:>8}{len(row['requests']):>6}"
+              f"{sum(r[0] for r in row['requests']):>11}{sum(r[1] for r in row['requests']):>11}")
+
+    requests = [request for row in rows for request in row['requests']]
+    input_tokens = sum(r[0] for r in requests)
+    output_tokens = sum(r[1] for r in requests)
+    # 除第一个请求外，系统消息前缀都能命中服务商的前缀缓存
+    prefix = estimate_tokens(translator.system_prompt) // PREFIX_CACHE_UNIT * PREFIX_CACHE_UNIT
+    cached_tokens = prefix * max(0, len(requests) - 1)
+    cost = ((input_tokens - cached_tokens) * args.price_input + cached_tokens * args.price_cached
+            + output_tokens * args.price_output) / 1e6
+    wall_time = estimate_wall_time(requests, args.concurrency, args.latency, args.output_tps)
+
+    print(f"\n合计: {len(rows)} 个文件，{sum(row['entries'] for row in rows)} 条，"
+          f"需请求 {sum(row['to_request'] for row in rows)} 条，共 {len(requests)} 个请求"
+          f"（{'已计入缓存' if cache is not None else '未使用缓存'}）")
+    print(f"估算token: 输入 {input_tokens}（其中前缀缓存约 {cached_tokens}），输出 {output_tokens}")
+    print(f"估算费用: {cost:.2f} 元（单价 输入{args.price_input:g}/缓存{args.price_cached:g}/输出{args.price_output:g} 元每百万token）")
+    print(f"估算耗时: {wall_time:.0f} 秒（并发 {args.concurrency}，每请求 {args.latency:g}s + 输出token/{args.output_tps:g}）")
+
+
+def main(argv: List[str] = None):
+    """命令行入口
+
+    python trans.py 输入 [输出] [模型]  直接翻译文件或目录
+    python trans.py queue ... / worker ...  多进程任务队列（见job_queue.py）
+    python trans.py plan 输入 [输出] [模型]  离线估算请求数、token、费用与耗时
+    """
     import sys
+    import argparse
     
-    if len(sys.argv) < 2:
-        print("用法: python trans.py <输入文件> [输出文件] [模型]")
-        print("示例: python trans.py zhs/cards.json silksong/cards.json deepseek-chat")
-        sys.exit(1)
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in ('queue', 'worker'):
+        from job_queue import queue_main
+        return queue_main(argv[0], argv[1:])
+    if argv and argv[0] == 'plan':
+        return plan_main(argv[1:])
     
-    input_file = sys.argv[1]
-    output_file = sys.argv[2] if len(sys.argv) > 2 else None
-    model = sys.argv[3] if len(sys.argv) > 3 else "deepseek-v3.1"
+    parser = argparse.ArgumentParser(
+        description="《杀戮尖塔》「丝之歌语言」翻译工具",
+        epilog="示例: python trans.py zhs/cards.json silksong/cards.json deepseek-chat\n"
+               "      python trans.py zhs/ silksong/\n"
+               "      python trans.py queue zhs/ silksong/ && python trans.py worker  （多进程/多机器分担）\n"
+               "      python trans.py plan zhs/ silksong/  （离线估算费用与耗时）",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('input', help="输入文件；若为目录则翻译目录下所有JSON文件")
+    parser.add_argument('output', nargs='?', default=None, help="输出文件（目录模式下为输出目录）")
+    parser.add_argument('model', nargs='?', default="deepseek-v3.1", help="模型名称")
+    add_translator_arguments(parser)
+    parser.add_argument('--incremental', action='store_true', help="增量模式：只翻译相对上次原文快照新增或变更的条目")
+    parser.add_argument('--resume', action='store_true', help="从上次中断时的批次日志续跑，跳过已完成的批次")
+    parser.add_argument('--low-memory', action='store_true',
+                        help="低内存模式：逐项流式读取与写出，内存占用与文件大小无关（超过64MB的文件自动启用）")
+    args = parser.parse_args(argv)
     
-    asyncio.run(translate_single_file(input_file, output_file, model))
\ No newline at end of file
+    translator = create_translator(args)
+    try:
+        # 提前创建客户端并核对后端模型，缺少API密钥或模型不一致时立即报错
+        translator.router
+        translator.served_model(args.model)
+        if os.path.isdir(args.input):
+            asyncio.run(translate_directory(args.input, args.output, args.model, translator,
+                                            args.incremental, args.resume, args.low_memory))
+        else:
+            translator.setup_logging(args.input)
+            asyncio.run(translate_single_file(args.input, args.output, args.model, translator,
+                                              args.incremental, args.resume, args.low_memory))
+    finally:
+        close_translator(translator)
+
+
+if __name__ == '__main__':
+    main()